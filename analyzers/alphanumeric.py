@@ -1,7 +1,12 @@
 import re
 
+_ALPHA_NUMERIC = re.compile('[a-zA-Z0-9]')
+
 
 class AlphaNumeric:
 
     def analyze(self, tokens):
-        return [token for token in tokens if re.search('[a-zA-Z0-9]', token) is not None]
+        return [token for token in tokens if self.analyze_token(token) is not None]
+
+    def analyze_token(self, token):
+        return token if _ALPHA_NUMERIC.search(token) is not None else None
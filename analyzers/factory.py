@@ -4,20 +4,26 @@ from .remove_stopwords import RemoveStopwords
 from .strip_html import StripHtml
 from .tokenize_numbers import TokenizeNumbers
 from .alphanumeric import AlphaNumeric
+from .pipeline import Pipeline
 
 
-def get_analyzer(key):
+def get_analyzer(key, **options):
         if key == 'lowercase':
-            return Lowercase()
+            return Lowercase(**options)
         elif key == 'porterstem':
-            return Porterstem()
+            return Porterstem(**options)
         elif key == 'remove_stopwords':
-            return RemoveStopwords()
+            return RemoveStopwords(**options)
         elif key == 'strip_html':
-            return StripHtml()
+            return StripHtml(**options)
         elif key == 'tokenize_numbers':
-            return TokenizeNumbers()
+            return TokenizeNumbers(**options)
         elif key == 'alpha_numeric':
-            return AlphaNumeric()
+            return AlphaNumeric(**options)
         else:
             raise LookupError("unknown analyzer key {}".format(key))
+
+
+def get_pipeline(keys, options=None):
+        options = options or {}
+        return Pipeline([get_analyzer(key, **options.get(key, {})) for key in keys])
@@ -2,3 +2,6 @@ class Lowercase:
 
     def analyze(self, tokens):
         return [token.lower() for token in tokens]
+
+    def analyze_token(self, token):
+        return token.lower()
@@ -0,0 +1,25 @@
+class Pipeline:
+    """Applies analyze_token() of each analyzer in one pass; a None result drops the token."""
+
+    def __init__(self, analyzers):
+        self.analyzers = analyzers
+        self._stages = [analyzer.analyze_token for analyzer in analyzers]
+
+    def analyze(self, tokens):
+        return list(self.stream(tokens))
+
+    def stream(self, tokens):
+        stages = self._stages
+        for token in tokens:
+            for stage in stages:
+                token = stage(token)
+                if token is None:
+                    break
+            else:
+                yield token
+
+    def close(self):
+        for analyzer in self.analyzers:
+            close = getattr(analyzer, 'close', None)
+            if close is not None:
+                close()
@@ -1,8 +1,35 @@
+import os
+
 from nltk.stem import *
 
+from caching.lru import LruCache
+
 
 class Porterstem:
 
+    def __init__(self, cache_size=100000, cache_file=None):
+        self._stemmer = SnowballStemmer('english')
+        self._cache = LruCache(cache_size)
+        self._cache_file = cache_file
+        if cache_file is not None and os.path.exists(cache_file):
+            self._cache.load(cache_file)
+
     def analyze(self, tokens):
-        stemmer = SnowballStemmer('english')
-        return [stemmer.stem(t) for t in tokens]
+        return [self.analyze_token(t) for t in tokens]
+
+    def analyze_token(self, token):
+        stem = self._cache.get(token)
+        if stem is None:
+            stem = self._stemmer.stem(token)
+            self._cache.put(token, stem)
+        return stem
+
+    def cache_info(self):
+        return self._cache.info()
+
+    def save_cache(self, cache_file=None):
+        self._cache.save(cache_file or self._cache_file)
+
+    def close(self):
+        if self._cache_file is not None:
+            self.save_cache()
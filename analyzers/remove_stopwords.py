@@ -1,8 +1,29 @@
 from nltk.corpus import stopwords
 
+_stopword_sets = {}
+
+
+def get_stopwords(languages=('english',), stopword_files=()):
+    key = (tuple(languages), tuple(stopword_files))
+    if key not in _stopword_sets:
+        nix_words = set()
+        for language in languages:
+            nix_words.update(stopwords.words(language))
+        for stopword_file in stopword_files:
+            with open(stopword_file) as f:
+                nix_words.update(line.strip() for line in f if line.strip())
+        _stopword_sets[key] = frozenset(nix_words)
+
+    return _stopword_sets[key]
+
 
 class RemoveStopwords:
 
+    def __init__(self, languages=('english',), stopword_files=()):
+        self._nix_words = get_stopwords(languages, stopword_files)
+
     def analyze(self, tokens):
-        nix_words = stopwords.words('english')
-        return [word for word in tokens if word not in nix_words]
+        return [word for word in tokens if word not in self._nix_words]
+
+    def analyze_token(self, token):
+        return None if token in self._nix_words else token
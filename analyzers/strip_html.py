@@ -3,9 +3,12 @@ from . import HtmlStripper
 
 class StripHtml:
 
-    def analyze(self, string):
-        # TODO this works differently in ubuntu vs anaconda
-        # on anaconda analyze('foo bar') returns 'foo bar'
-        # on ubuntu the empty string is returned.
-        raise Exception('not implemented')
-        return HtmlStripper.strip_tags(string)
+    # TODO this works differently in ubuntu vs anaconda
+    # on anaconda analyze('foo bar') returns 'foo bar'
+    # on ubuntu the empty string is returned.
+    def analyze(self, tokens):
+        return [token for token in map(self.analyze_token, tokens) if token is not None]
+
+    def analyze_token(self, token):
+        token = HtmlStripper.strip_tags(token).strip()
+        return token if len(token) != 0 else None
@@ -1,10 +1,12 @@
 import re
 
+_NUMBER = re.compile(r'[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?')
+
 
 class TokenizeNumbers:
 
     def analyze(self, tokens):
-        return ['{__NUMBER__}'
-                if re.match('[-+]?[0-9]*\.?[0-9]+([eE][-+]?[0-9]+)?', token) is not None
-                else token
-                for token in tokens]
+        return [self.analyze_token(token) for token in tokens]
+
+    def analyze_token(self, token):
+        return '{__NUMBER__}' if _NUMBER.match(token) is not None else token
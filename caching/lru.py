@@ -0,0 +1,56 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class LruCache:
+    """Thread-safe bounded mapping that evicts the least recently used entry; maxsize None means unbounded."""
+
+    def __init__(self, maxsize=100000):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if self._maxsize is not None and self._maxsize < len(self._entries):
+                self._entries.popitem(last=False)
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'maxsize': self._maxsize}
+
+    def save(self, fqn):
+        tmp_fqn = '{}.tmp'.format(fqn)
+        with self._lock:
+            entries = list(self._entries.items())
+        with open(tmp_fqn, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_fqn, fqn)
+
+    def load(self, fqn):
+        with open(fqn) as f:
+            for key, value in json.load(f):
+                self.put(key, value)
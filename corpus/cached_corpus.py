@@ -0,0 +1,155 @@
+import json
+import os
+import time
+import zlib
+
+
+class DocumentStore:
+    """Local store of fetched docs, keyed by index/doc_type/id.
+
+    Docs are zlib compressed json appended to segment files. The catalog
+    (doc locations and corpus manifests) is written on flush(). Entries older
+    than ttl seconds are ignored, and the oldest segments are deleted once
+    the segments exceed max_bytes. A store must only be used by one process
+    at a time.
+    """
+
+    def __init__(self, cache_dir, ttl=None, max_bytes=None, segment_bytes=64 * 1024 * 1024):
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._segment_bytes = segment_bytes
+        self._readers = {}
+        self._writer = None
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._catalog_name = os.path.join(cache_dir, 'catalog.js')
+        if os.path.exists(self._catalog_name):
+            with open(self._catalog_name) as f:
+                self._catalog = json.load(f)
+        else:
+            self._catalog = {'segments': [], 'docs': {}, 'manifests': {}}
+
+    def get(self, key):
+        entry = self._catalog['docs'].get(key)
+        if entry is None or self._expired(entry[3]):
+            return None
+
+        segment, offset, length, _ = entry
+        if segment not in self._readers:
+            self._readers[segment] = open(self._segment_name(segment), 'rb')
+        if self._writer is not None:
+            self._writer.flush()
+        reader = self._readers[segment]
+        reader.seek(offset)
+        return json.loads(zlib.decompress(reader.read(length)).decode('utf-8'))
+
+    def put(self, doc):
+        key = get_key(doc)
+        record = zlib.compress(json.dumps(doc).encode('utf-8'))
+        writer = self._get_writer()
+        offset = writer.tell()
+        writer.write(record)
+        self._catalog['docs'][key] = [self._catalog['segments'][-1], offset, len(record), time.time()]
+        return key
+
+    def get_manifest(self, name):
+        """Return the doc keys stored for a corpus, or None if any of them is missing or expired."""
+        manifest = self._catalog['manifests'].get(name)
+        if manifest is None or self._expired(manifest['time']):
+            return None
+
+        docs = self._catalog['docs']
+        for key in manifest['keys']:
+            if key not in docs or self._expired(docs[key][3]):
+                return None
+
+        return manifest['keys']
+
+    def put_manifest(self, name, keys):
+        self._catalog['manifests'][name] = {'keys': keys, 'time': time.time()}
+
+    def flush(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._evict()
+
+        tmp_name = '{}.tmp'.format(self._catalog_name)
+        with open(tmp_name, 'w') as f:
+            json.dump(self._catalog, f)
+        os.replace(tmp_name, self._catalog_name)
+
+    def _get_writer(self):
+        if self._writer is not None and self._writer.tell() < self._segment_bytes:
+            return self._writer
+
+        if self._writer is not None:
+            self._writer.close()
+        segments = self._catalog['segments']
+        segments.append(segments[-1] + 1 if segments else 0)
+        self._writer = open(self._segment_name(segments[-1]), 'ab')
+        return self._writer
+
+    def _evict(self):
+        segments = self._catalog['segments']
+        sizes = {s: os.path.getsize(self._segment_name(s)) for s in segments}
+        newest = {}
+        for segment, _, _, stored_time in self._catalog['docs'].values():
+            newest[segment] = max(newest.get(segment, 0), stored_time)
+
+        while segments and (self._expired(newest.get(segments[0], 0)) or
+                            (self._max_bytes is not None and self._max_bytes < sum(sizes.values()))):
+            segment = segments.pop(0)
+            sizes.pop(segment)
+            if segment in self._readers:
+                self._readers.pop(segment).close()
+            os.remove(self._segment_name(segment))
+            self._catalog['docs'] = {k: v for k, v in self._catalog['docs'].items() if v[0] != segment}
+
+    def _expired(self, stored_time):
+        return self._ttl is not None and self._ttl < time.time() - stored_time
+
+    def _segment_name(self, segment):
+        return os.path.join(self._cache_dir, 'segment-{:06d}.z'.format(segment))
+
+
+class CachedCorpus:
+    """Wraps a corpus provider and replays its docs from a DocumentStore on repeat runs.
+
+    name must identify what the provider returns, e.g. 'webpages-howstuffworks'.
+    """
+
+    def __init__(self, provider, store, name):
+        self._provider = provider
+        self._store = store
+        self._name = name
+
+    def corpus(self):
+        keys = self._store.get_manifest(self._name)
+        if keys is not None:
+            for key in keys:
+                yield self._store.get(key)
+            return
+
+        keys = []
+        for doc in self._provider.corpus():
+            keys.append(self._store.put(doc))
+            yield doc
+
+        self._store.put_manifest(self._name, keys)
+        self._store.flush()
+
+
+def get_key(doc):
+    return '{}/{}/{}'.format(doc.get('_index'), doc.get('_type'), doc['_id'])
+
+
+def wrap(provider, name, cache_dir, ttl_hours=None, max_mb=None):
+    """Return provider wrapped in a CachedCorpus, or unchanged when cache_dir is None."""
+    if cache_dir is None:
+        return provider
+
+    ttl = None if ttl_hours is None else ttl_hours * 3600
+    max_bytes = None if max_mb is None else max_mb * 1024 * 1024
+    return CachedCorpus(provider, DocumentStore(cache_dir, ttl=ttl, max_bytes=max_bytes), name)
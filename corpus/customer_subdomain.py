@@ -1,22 +1,17 @@
-import elasticsearch
 import json
 import os
 
+from . import es_client
+from .mget import mget
+
 
 class CustomerSubdomain:
-    def __init__(self, customer_id, subdomain):
+    def __init__(self, customer_id, subdomain, batch_size=500, max_in_flight=1):
         self._customer_id = customer_id
         self._subdomain = subdomain
-        self._es = elasticsearch.Elasticsearch(
-            ['signals-es-access-1.test.inspcloud.com', 'signals-es-access-2.test.inspcloud.com'],
-            sniff_on_start=True,
-            sniff_on_connection_fail=True,
-            sniff_timeout=10,
-            sniffer_timeout=600,
-            timeout=60,
-            retry_on_timeout=True,
-            max_retries=10
-        )
+        self._batch_size = batch_size
+        self._max_in_flight = max_in_flight
+        self._es = es_client.get_client()
 
     def corpus(self):
         file_name = '{}-{}.js'.format(self._customer_id, self._subdomain)
@@ -24,13 +19,5 @@ class CustomerSubdomain:
         with open(fqn_name) as f:
             corpus = json.load(f)
 
-        loop_counter = 0
-        for url in corpus['urls']:
-            loop_counter += 1
-
-            yield self._es.get(
-                index='signals_read',
-                id=url,
-                doc_type='webpage',
-                _source=['title', 'content']
-            )
+        return mget(self._es, corpus['urls'], 'signals_read', 'webpage', ['title', 'content'],
+                    batch_size=self._batch_size, max_in_flight=self._max_in_flight)
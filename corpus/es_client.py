@@ -0,0 +1,41 @@
+import elasticsearch
+import os
+import threading
+
+# every setting can be overridden from the environment, e.g. to point the tools at a local cluster:
+#   SIGNALS_ES_HOSTS=localhost:9200 SIGNALS_ES_SNIFF=0 ./fb_ctr_timeliness/gen_index.py ...
+_DEFAULT_HOSTS = 'signals-es-access-1.test.inspcloud.com,signals-es-access-2.test.inspcloud.com'
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide client, creating it on first use.
+
+    Clients are keyed by pid so that a forked worker builds its own connection pool.
+    """
+    pid = os.getpid()
+    with _clients_lock:
+        if pid not in _clients:
+            _clients.clear()
+            _clients[pid] = create_client()
+        return _clients[pid]
+
+
+def create_client(hosts=None):
+    if hosts is None:
+        hosts = os.environ.get('SIGNALS_ES_HOSTS', _DEFAULT_HOSTS).split(',')
+    sniff = os.environ.get('SIGNALS_ES_SNIFF', '1') == '1'
+
+    return elasticsearch.Elasticsearch(
+        hosts,
+        sniff_on_start=sniff,
+        sniff_on_connection_fail=sniff,
+        sniff_timeout=10,
+        sniffer_timeout=600 if sniff else None,
+        timeout=int(os.environ.get('SIGNALS_ES_TIMEOUT', 60)),
+        retry_on_timeout=True,
+        max_retries=int(os.environ.get('SIGNALS_ES_MAX_RETRIES', 10)),
+        maxsize=int(os.environ.get('SIGNALS_ES_POOL_SIZE', 10))
+    )
@@ -1,25 +1,18 @@
-import elasticsearch
-from elasticsearch.helpers import scan
+from . import es_client
+from .sliced_scan import sliced_scan
 
 
 class CustomerWebpages:
-    def __init__(self, customer_id):
+    def __init__(self, customer_id, slices=None):
         self._customer_id = customer_id
-        self._es = elasticsearch.Elasticsearch(
-            ['signals-es-access-1.test.inspcloud.com', 'signals-es-access-2.test.inspcloud.com'],
-            sniff_on_start=True,
-            sniff_on_connection_fail=True,
-            sniff_timeout=10,
-            sniffer_timeout=600,
-            timeout=60,
-            retry_on_timeout=True,
-            max_retries=10
-        )
+        self._slices = slices
+        self._es = es_client.get_client()
 
     def corpus(self):
-        return scan(self._es,
-                    query={"query": {"match": {"customerId": self._customer_id}}},
-                    index='signals_read',
-                    doc_type='webpage',
-                    _source=['title', 'content']
-                    )
+        return sliced_scan(self._es,
+                           query={"query": {"match": {"customerId": self._customer_id}}},
+                           index='signals_read',
+                           doc_type='webpage',
+                           slices=self._slices,
+                           _source=['title', 'content']
+                           )
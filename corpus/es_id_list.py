@@ -1,10 +1,12 @@
-import elasticsearch
-from elasticsearch.helpers import scan
+from . import es_client
+from .mget import mget
 
 
 class EsIdList:
-    def __init__(self, id_list, fields=None, index=None, doc_type='webpage'):
+    def __init__(self, id_list, fields=None, index=None, doc_type='webpage', batch_size=500, max_in_flight=1):
         self._id_list = id_list
+        self._batch_size = batch_size
+        self._max_in_flight = max_in_flight
         self._doc_type = doc_type
 
         self._fields = fields
@@ -23,25 +25,8 @@ class EsIdList:
         elif index is None and doc_type == 'facebookSocialMetrics':
             self._index = 'signals_time_series_20160601'
 
-        self._es = elasticsearch.Elasticsearch(
-            ['signals-es-access-1.test.inspcloud.com', 'signals-es-access-2.test.inspcloud.com'],
-            sniff_on_start=True,
-            sniff_on_connection_fail=True,
-            sniff_timeout=10,
-            sniffer_timeout=600,
-            timeout=60,
-            retry_on_timeout=True,
-            max_retries=10
-        )
+        self._es = es_client.get_client()
 
     def corpus(self):
-        loop_counter = 0
-        for doc_id in self._id_list:
-            loop_counter += 1
-
-            yield self._es.get(
-                index=self._index,
-                id=doc_id,
-                doc_type=self._doc_type,
-                _source=self._fields
-            )
+        return mget(self._es, self._id_list, self._index, self._doc_type, self._fields,
+                    batch_size=self._batch_size, max_in_flight=self._max_in_flight)
@@ -0,0 +1,18 @@
+import threading
+
+# page name -> nodeId, looked up once per process and shared by the facebook providers
+_node_ids = {}
+_node_ids_lock = threading.Lock()
+
+
+def get_node_id(es, page_name):
+    with _node_ids_lock:
+        if page_name not in _node_ids:
+            response = es.search(
+                body={"query": {"match": {"name": page_name}}},
+                index='signals_read',
+                doc_type='facebookTrendPage',
+                _source=['nodeId']
+            )
+            _node_ids[page_name] = response['hits']['hits'][0]['_source']['nodeId']
+        return _node_ids[page_name]
@@ -1,31 +1,15 @@
-import elasticsearch
 from elasticsearch.helpers import scan
 
+from . import es_client, fb_page
+
 
 class FacebookSocialMetrics:
     def __init__(self, page_name):
         self._page_name = page_name
-        self._es = elasticsearch.Elasticsearch(
-            ['signals-es-access-1.test.inspcloud.com', 'signals-es-access-2.test.inspcloud.com'],
-            sniff_on_start=True,
-            sniff_on_connection_fail=True,
-            sniff_timeout=10,
-            sniffer_timeout=600,
-            timeout=60,
-            retry_on_timeout=True,
-            max_retries=10
-        )
+        self._es = es_client.get_client()
 
     def corpus(self):
-
-        response = self._es.search(
-            body={"query": {"match": {"name": self._page_name}}},
-            index='signals_read',
-            doc_type='facebookTrendPage',
-            _source=['nodeId']
-        )
-
-        node_id = response['hits']['hits'][0]['_source']['nodeId']
+        node_id = fb_page.get_node_id(self._es, self._page_name)
 
         return scan(self._es,
                     query={"query": {"match": {"parentPageId": node_id}}},
@@ -1,54 +1,28 @@
-import elasticsearch
-from elasticsearch.helpers import scan
+from . import es_client, fb_page
+from .mget import mget
+from .sliced_scan import sliced_scan
 
 
 class FacebookTrends:
-    def __init__(self, page_name):
+    def __init__(self, page_name, slices=None, batch_size=500, max_in_flight=1):
         self._page_name = page_name
-        self._parent_page_id = None
-        self._es = elasticsearch.Elasticsearch(
-            ['signals-es-access-1.test.inspcloud.com', 'signals-es-access-2.test.inspcloud.com'],
-            sniff_on_start=True,
-            sniff_on_connection_fail=True,
-            sniff_timeout=10,
-            sniffer_timeout=600,
-            timeout=60,
-            retry_on_timeout=True,
-            max_retries=10
-        )
+        self._slices = slices
+        self._batch_size = batch_size
+        self._max_in_flight = max_in_flight
+        self._es = es_client.get_client()
 
+    # trendpages are keyed by url, the ones that no longer exist are skipped
     def corpus(self):
-
-        response = self._es.search(
-            body={"query": {"match": {"name": self._page_name}}},
-            index='signals_read',
-            doc_type='facebookTrendPage',
-            _source=['nodeId']
-        )
-
-        self._parent_page_id = response['hits']['hits'][0]['_source']['nodeId']
-
-        for trend in self.page_trend_corpus():
-
-            try:
-                hit = self._es.get(
-                    index='signals_read',
-                    doc_type='trendpage',
-                    id=trend['_source']['url']
-                )
-                yield hit
-            except:
-                continue
+        urls = (hit['_source']['url'] for hit in self.page_trend_corpus() if hit['_source'].get('url') is not None)
+        return mget(self._es, urls, 'signals_read', 'trendpage', ['title', 'content'],
+                    batch_size=self._batch_size, max_in_flight=self._max_in_flight)
 
     def page_trend_corpus(self):
-        for hit in self.facebook_trend_corpus():
-            if hit['_source']['parentPageId'] == self._parent_page_id:
-                yield hit
-
-    def facebook_trend_corpus(self):
-        return scan(self._es,
-                    query={"query": {"match_all": {}}},
-                    index="signals_time_series_20160601",
-                    doc_type="facebookTrend",
-                    _source=['url', 'parentPageId']
-                    )
+        parent_page_id = fb_page.get_node_id(self._es, self._page_name)
+        return sliced_scan(self._es,
+                           query={"query": {"match": {"parentPageId": parent_page_id}}},
+                           index="signals_time_series_20160601",
+                           doc_type="facebookTrend",
+                           slices=self._slices,
+                           _source=['url', 'parentPageId']
+                           )
@@ -0,0 +1,35 @@
+import sys
+
+from parallel import batching, ordered
+
+# missing ids printed in the summary, the rest are only counted
+_MAX_REPORTED_IDS = 10
+
+
+def mget(es, ids, index, doc_type, fields, batch_size=500, max_in_flight=1):
+    """Yield the docs for ids in order, fetching batch_size ids per mget request.
+
+    Up to max_in_flight requests run concurrently. Ids that are not found are
+    skipped, and their count and the first few of them are printed to stderr.
+    """
+    def fetch(batch_ids):
+        response = es.mget(body={'ids': batch_ids}, index=index, doc_type=doc_type, _source=fields)
+        return response['docs']
+
+    requested = 0
+    missing = 0
+    missing_ids = []
+    for docs in ordered.bounded_map(fetch, batching.batches(ids, batch_size), max_in_flight):
+        for doc in docs:
+            requested += 1
+            if doc.get('found', False):
+                yield doc
+                continue
+
+            missing += 1
+            if len(missing_ids) < _MAX_REPORTED_IDS:
+                missing_ids.append(doc.get('_id'))
+
+    if missing:
+        print('mget {}/{}: {} of {} ids not found, e.g. {}'.format(
+            index, doc_type, missing, requested, missing_ids), file=sys.stderr)
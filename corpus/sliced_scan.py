@@ -0,0 +1,76 @@
+import os
+import queue
+import threading
+
+from elasticsearch.helpers import scan
+
+# defaults can be overridden from the environment like the client settings in es_client, e.g.
+#   SIGNALS_ES_SCAN_SLICES=8 ./fb_ctr_timeliness/gen_dictionary.py ...
+# sliced scroll needs elasticsearch 5 or later, one slice is a plain scroll
+
+_DONE = object()
+
+
+def sliced_scan(es, query, index, doc_type=None, slices=None, size=None, scroll=None, **kwargs):
+    """Like helpers.scan(), but reads the query as slices concurrent sliced scrolls.
+
+    Each slice is scrolled in its own thread, every scroll request returning
+    up to size hits of that slice, so slices requests of size hits are in
+    flight at once. The scroll context is kept alive for scroll between
+    requests. Hits from all slices are merged into one generator in no
+    particular order.
+    """
+    if slices is None:
+        slices = int(os.environ.get('SIGNALS_ES_SCAN_SLICES', 1))
+    if size is None:
+        size = int(os.environ.get('SIGNALS_ES_SCROLL_SIZE', 1000))
+    if scroll is None:
+        scroll = os.environ.get('SIGNALS_ES_SCROLL_KEEP_ALIVE', '5m')
+
+    if slices <= 1:
+        yield from scan(es, query=query, index=index, doc_type=doc_type, size=size, scroll=scroll, **kwargs)
+        return
+
+    # slices hand over whole pages, and at most two pages per slice wait to be consumed
+    pages = queue.Queue(2 * slices)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def scroll_slice(slice_id):
+        try:
+            slice_query = dict(query or {}, slice={'id': slice_id, 'max': slices})
+            page = []
+            for hit in scan(es, query=slice_query, index=index, doc_type=doc_type, size=size, scroll=scroll, **kwargs):
+                page.append(hit)
+                if size <= len(page):
+                    if not put(page):
+                        return
+                    page = []
+            put(page)
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+
+    for slice_id in range(slices):
+        threading.Thread(target=scroll_slice, args=(slice_id,), daemon=True).start()
+
+    try:
+        remaining = slices
+        while remaining:
+            page = pages.get()
+            if page is _DONE:
+                remaining -= 1
+                continue
+            if isinstance(page, BaseException):
+                raise page
+            yield from page
+    finally:
+        stopped.set()
@@ -0,0 +1,103 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+
+FORMAT_VERSION = 1
+
+
+# analyzer options that only tune caching and leave the tokens unchanged
+_CACHE_OPTIONS = {'porterstem': ('cache_size', 'cache_file')}
+
+
+def analysis_options(analyzer_keys, options=None):
+    """The options of the analyzers in the chain that decide their output, stopword files by content."""
+    options = options or {}
+    config = {}
+    for key in analyzer_keys:
+        key_options = {name: value for name, value in sorted(options.get(key, {}).items())
+                       if name not in _CACHE_OPTIONS.get(key, ())}
+        if 'stopword_files' in key_options:
+            key_options['stopword_files'] = [_file_digest(name) for name in key_options['stopword_files']]
+        if key_options:
+            config[key] = key_options
+    return config
+
+
+def fingerprint(analyzer_keys, options=None):
+    config = {'version': FORMAT_VERSION, 'analyzers': list(analyzer_keys)}
+    analyzer_options = analysis_options(analyzer_keys, options)
+    if analyzer_options:
+        config['options'] = analyzer_options
+    return hashlib.sha1(json.dumps(config).encode('utf-8')).hexdigest()[:12]
+
+
+def _file_digest(fname):
+    with open(fname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class TokenCorpus:
+    """Analyzed token streams of a corpus, written once and read by later stages.
+
+    The file name carries a fingerprint of the analyzer keys and of the options
+    that change their output, like stopword lists, so changing the analysis
+    makes exists() false until the corpus is written again.
+    Each line after the json header holds a doc id, the tokens first seen in
+    that doc, and the doc's fields as lists of token ids.
+    """
+
+    def __init__(self, name, analyzer_keys, options=None, directory=os.path.join('out', 'tokens')):
+        self._name = name
+        self._analyzer_keys = list(analyzer_keys)
+        self._options = analysis_options(analyzer_keys, options)
+        self._fingerprint = fingerprint(analyzer_keys, options)
+        self._directory = directory
+        self._fqn_name = os.path.join(directory, '{}-{}.tok.gz'.format(name, self._fingerprint))
+
+    def exists(self):
+        return os.path.exists(self._fqn_name)
+
+    def write(self, docs):
+        """Write an iterable of (doc_id, {field: tokens}) and drop files from other analyses."""
+        os.makedirs(self._directory, exist_ok=True)
+        header = {'version': FORMAT_VERSION, 'analyzers': self._analyzer_keys, 'options': self._options,
+                  'fingerprint': self._fingerprint}
+        token_ids = {}
+
+        tmp_name = '{}.tmp'.format(self._fqn_name)
+        with gzip.open(tmp_name, 'wt', encoding='utf-8') as f:
+            f.write(json.dumps(header) + '\n')
+            for doc_id, fields in docs:
+                new_tokens = []
+                field_ids = {}
+                for field, tokens in fields.items():
+                    ids = []
+                    for token in tokens:
+                        if token not in token_ids:
+                            token_ids[token] = len(token_ids)
+                            new_tokens.append(token)
+                        ids.append(token_ids[token])
+                    field_ids[field] = ids
+                f.write(json.dumps([doc_id, new_tokens, field_ids]) + '\n')
+        os.replace(tmp_name, self._fqn_name)
+
+        stale_pattern = '{}-{}.tok.gz'.format(glob.escape(self._name), '[0-9a-f]' * len(self._fingerprint))
+        for stale_name in glob.glob(os.path.join(self._directory, stale_pattern)):
+            if stale_name != self._fqn_name:
+                os.remove(stale_name)
+
+    def corpus(self):
+        """Yield (doc_id, {field: tokens}) in the order the docs were written."""
+        tokens = []
+        with gzip.open(self._fqn_name, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header['fingerprint'] != self._fingerprint:
+                raise ValueError('{} was written by analyzers {} with options {}'.format(
+                    self._fqn_name, header['analyzers'], header.get('options', {})))
+
+            for line in f:
+                doc_id, new_tokens, field_ids = json.loads(line)
+                tokens.extend(new_tokens)
+                yield doc_id, {field: [tokens[i] for i in ids] for field, ids in field_ids.items()}
@@ -1,8 +1,142 @@
 import argparse
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from elasticsearch import Elasticsearch, helpers
 
 
+class BulkUpdater:
+    """Sends bulk actions with several requests in flight and a batch size that follows the cluster.
+
+    The batch size grows while requests come back faster than target_seconds,
+    shrinks when they are slower, and is halved whenever items are rejected
+    with 429. Rejected items are resent after an exponential backoff, up to
+    max_retries times. on_done is called with the actions of every batch once
+    they have been applied. With dry_run nothing is sent, so the scan rate
+    alone is reported.
+    """
+
+    def __init__(self, es, batch_size=100, min_batch_size=10, max_batch_size=5000, max_in_flight=4,
+                 target_seconds=1.0, max_retries=5, dry_run=False, report_seconds=30, on_done=None):
+        self._es = es
+        self.batch_size = batch_size
+        self._min_batch_size = min_batch_size
+        self._max_batch_size = max_batch_size
+        self._max_in_flight = max_in_flight
+        self._target_seconds = target_seconds
+        self._max_retries = max_retries
+        self._dry_run = dry_run
+        self._report_seconds = report_seconds
+        self._on_done = on_done
+
+        self._lock = threading.Lock()
+        self._counts = {'scanned': 0, 'sent': 0, 'updated': 0, 'noop': 0, 'rejected': 0, 'failed': 0}
+
+    def run(self, actions):
+        self._started = time.time()
+        self._reported = self._started
+
+        with ThreadPoolExecutor(self._max_in_flight) as executor:
+            pending = set()
+            batch = []
+            for action in actions:
+                self._counts['scanned'] += 1
+                if self._dry_run:
+                    self._maybe_report()
+                    continue
+
+                batch.append(action)
+                if len(batch) < self.batch_size:
+                    continue
+
+                # the scroll only moves on while fewer than max_in_flight requests are outstanding
+                while self._max_in_flight <= len(pending):
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(self._send, batch))
+                batch = []
+                self._maybe_report()
+
+            if batch:
+                pending.add(executor.submit(self._send, batch))
+            for future in pending:
+                future.result()
+
+        self._report()
+        return dict(self._counts)
+
+    def _send(self, batch):
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                time.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.0))
+
+            started = time.time()
+            results = helpers.streaming_bulk(self._es, batch, chunk_size=len(batch), max_retries=0,
+                                             raise_on_error=False, raise_on_exception=False)
+            rejected = []
+            done = []
+            counts = {'sent': len(batch), 'updated': 0, 'noop': 0, 'rejected': 0, 'failed': 0}
+            for action, (ok, item) in zip(batch, results):
+                info = next(iter(item.values()))
+                if ok:
+                    done.append(action)
+                    counts['noop' if info.get('result') == 'noop' else 'updated'] += 1
+                elif info.get('status') == 429:
+                    rejected.append(action)
+                else:
+                    counts['failed'] += 1
+                    print('failed {}: {}'.format(info.get('_id'), info.get('error')), file=sys.stderr)
+            counts['rejected'] = len(rejected)
+
+            self._adapt(time.time() - started, len(batch), len(rejected))
+            with self._lock:
+                for key, value in counts.items():
+                    self._counts[key] += value
+                if self._on_done is not None and done:
+                    self._on_done(done)
+
+            if not rejected:
+                return
+            batch = rejected
+
+        with self._lock:
+            self._counts['failed'] += len(batch)
+        print('gave up on {} rejected docs'.format(len(batch)), file=sys.stderr)
+
+    # additive increase while fast, multiplicative decrease when slow or rejected
+    def _adapt(self, seconds, sent, rejected):
+        with self._lock:
+            if rejected:
+                size = self.batch_size // 2
+            elif seconds * 2 < self._target_seconds and self.batch_size <= sent:
+                size = self.batch_size + max(self._min_batch_size, self.batch_size // 4)
+            elif self._target_seconds < seconds:
+                size = int(self.batch_size * 0.75)
+            else:
+                return
+            self.batch_size = max(self._min_batch_size, min(self._max_batch_size, size))
+
+    def _maybe_report(self):
+        if self._report_seconds <= time.time() - self._reported:
+            self._report()
+
+    def _report(self):
+        self._reported = time.time()
+        elapsed = max(self._reported - self._started, 1e-9)
+        with self._lock:
+            counts = dict(self._counts)
+        print('{:.0f}s scanned {} ({:.0f}/s) sent {} ({:.0f}/s) updated {} noop {} rejected {} failed {} '
+              'batch size {}{}'.format(
+                  elapsed, counts['scanned'], counts['scanned'] / elapsed, counts['sent'], counts['sent'] / elapsed,
+                  counts['updated'], counts['noop'], counts['rejected'], counts['failed'], self.batch_size,
+                  ' (dry run)' if self._dry_run else ''))
+
+
 class Program:
 
     def main(self):
@@ -13,6 +147,11 @@ class Program:
         query = {
             'fields': []
         }
+        # skips documents without the field, already converted ones still match and come back as noops
+        if self.args.filter_exists:
+            query['query'] = {'bool': {'filter': {'exists': {'field': self.args.field}}}}
+
+        done_ids = self._load_checkpoint()
 
         scan = helpers.scan(es,
                             index=self.args.index,
@@ -20,6 +159,46 @@ class Program:
                             query=query,
                             scroll='5m')
 
+        updater = BulkUpdater(es,
+                              batch_size=self.args.batch_size,
+                              min_batch_size=self.args.min_batch_size,
+                              max_batch_size=self.args.max_batch_size,
+                              max_in_flight=self.args.max_in_flight,
+                              target_seconds=self.args.target_seconds,
+                              max_retries=self.args.max_retries,
+                              dry_run=self.args.dry_run,
+                              report_seconds=self.args.report_seconds,
+                              on_done=self._save_checkpoint)
+        try:
+            updater.run(self._update_actions(scan, done_ids))
+        finally:
+            if self._checkpoint_file is not None:
+                self._checkpoint_file.close()
+
+    # the checkpoint is an append-only log of the ids whose update has been applied.
+    # scroll contexts expire within minutes, so a resumed run rescans and skips those ids
+    def _load_checkpoint(self):
+        self._checkpoint_file = None
+        if self.args.checkpoint is None:
+            return set()
+
+        done_ids = set()
+        if self.args.resume and os.path.exists(self.args.checkpoint):
+            with open(self.args.checkpoint) as f:
+                done_ids = {line.rstrip('\n') for line in f if line.endswith('\n')}
+            print('resuming, skipping {} updated docs'.format(len(done_ids)))
+
+        if not self.args.dry_run:
+            self._checkpoint_file = open(self.args.checkpoint, 'a' if self.args.resume else 'w')
+        return done_ids
+
+    def _save_checkpoint(self, actions):
+        if self._checkpoint_file is None:
+            return
+        self._checkpoint_file.write(''.join('{}\n'.format(action['_id']) for action in actions))
+        self._checkpoint_file.flush()
+
+    def _update_actions(self, scan, done_ids):
         field = self.args.field
         script_template = """if (ctx._source.containsKey("{}") && ctx._source["{}"] instanceof LinkedHashMap)
                                 ctx._source["{}"] = [ctx._source["{}"]]
@@ -27,27 +206,18 @@ class Program:
                                 ctx.op = "none" """
         script = script_template.format(field, field, field, field)
 
-        bulk_update_query = []
-        processed_count = 0
         for doc in scan:
-            processed_count += 1
-            bulk_update_query.append(
-                {
-                 '_op_type': 'update',
-                 '_index': self.args.index,
-                 '_type': self.args.doc_type,
-                 '_retry_on_conflict': 3,
-                 '_id': doc['_id'],
-                 'script': script
-                })
-
-            if 99 < len(bulk_update_query):
-                print("processed {} docs".format(processed_count))
-                helpers.bulk(es, bulk_update_query)
-                bulk_update_query = []
-
-        if 0 < len(bulk_update_query):
-            helpers.bulk(es, bulk_update_query)
+            if doc['_id'] in done_ids:
+                continue
+
+            yield {
+                '_op_type': 'update',
+                '_index': self.args.index,
+                '_type': self.args.doc_type,
+                '_retry_on_conflict': 3,
+                '_id': doc['_id'],
+                'script': script
+            }
 
     def _parse_args(self):
         parser = argparse.ArgumentParser('Converts an elasticsearch field to an array of that type')
@@ -55,6 +225,19 @@ class Program:
         parser.add_argument('--index', required=True, help='elasticsearch index')
         parser.add_argument('--doc_type', required=True, help='elasticsearch type')
         parser.add_argument('--field', required=True, help='elasticsearch field to convert')
+        parser.add_argument('--batch_size', type=int, default=100, help='initial docs per bulk request')
+        parser.add_argument('--min_batch_size', type=int, default=10)
+        parser.add_argument('--max_batch_size', type=int, default=5000)
+        parser.add_argument('--max_in_flight', type=int, default=4, help='concurrent bulk requests')
+        parser.add_argument('--target_seconds', type=float, default=1.0,
+                            help='bulk latency the batch size is tuned towards')
+        parser.add_argument('--max_retries', type=int, default=5, help='resends of docs rejected with 429')
+        parser.add_argument('--dry_run', action='store_true', help='scan and report without sending updates')
+        parser.add_argument('--report_seconds', type=float, default=30)
+        parser.add_argument('--filter_exists', action='store_true',
+                            help='skip documents that lack the field, ones already converted still get noop updates')
+        parser.add_argument('--checkpoint', help='file logging the ids of updated docs')
+        parser.add_argument('--resume', action='store_true', help='skip the docs already logged in --checkpoint')
         self.args = parser.parse_args()
 
 
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import json
+import os
+import time
+
+from gensim import corpora
+from nltk.tokenize import word_tokenize
+
+from analyzers import factory
+from corpus import es_customer_webpages
+from matching.lsh_index import LshIndex
+from matching.sharded_index import ShardedIndex
+
+
+class Program:
+    def __init__(self):
+        analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
+        self._analyzer = factory.get_pipeline(analyzer_keys)
+
+    def main(self):
+        self._parse_args()
+        self._title_content_dict = corpora.Dictionary.load(
+            os.path.join('out', 'dictionary', 'howstuffworks-all-1000-tokens.mm'))
+        exact_index = ShardedIndex.load(os.path.join('out', 'gensim-similarity-20160608-index'))
+        ann_index = LshIndex.load(os.path.join('out', 'lsh-20160608-index'))
+        ann_index.probe_radius = self.args.lsh_probe_radius
+
+        bows = list(itertools.islice(self._query_bows(), self.args.sample))
+        exact_results, exact_seconds = _timed_queries(exact_index, bows)
+        ann_results, ann_seconds = _timed_queries(ann_index, bows)
+
+        top_one_hits = 0
+        top_k_overlap = 0
+        for exact, ann in zip(exact_results, ann_results):
+            if len(exact) == 0:
+                continue
+            # ties on the best score count as a hit
+            if 0 < len(ann) and exact[0][1] - ann[0][1] < 1e-6:
+                top_one_hits += 1
+            top_k_overlap += len({i for i, _ in exact} & {i for i, _ in ann}) / len(exact)
+
+        report = {
+            'queries': len(bows),
+            'recall_at_1': top_one_hits / max(len(bows), 1),
+            'recall_at_k': top_k_overlap / max(len(bows), 1),
+            'exact_ms_per_query': 1000 * exact_seconds / max(len(bows), 1),
+            'ann_ms_per_query': 1000 * ann_seconds / max(len(bows), 1)
+        }
+        print(json.dumps(report, sort_keys=True, indent=2))
+
+    def _query_bows(self):
+        customer_webpages = es_customer_webpages.CustomerWebpages(self.args.customer_id)
+        for doc in customer_webpages.corpus():
+            fields = [doc['_source'].get(field) for field in ['title', 'content']]
+            txt = ' '.join(value for value in fields if value is not None)
+            bow = self._title_content_dict.doc2bow(self._analyzer.analyze(word_tokenize(txt)))
+            if len(bow) != 0:
+                yield bow
+
+    def _parse_args(self):
+        parser = argparse.ArgumentParser('measures recall and latency of the lsh trend index against the exact index')
+        parser.add_argument('--customer_id', default='howstuffworks', help='webpages used as queries')
+        parser.add_argument('--sample', type=int, default=1000, help='number of query webpages')
+        parser.add_argument('--lsh_probe_radius', type=int, default=1, help='bits flipped when probing lsh buckets')
+        self.args = parser.parse_args()
+
+
+def _timed_queries(index, bows):
+    start = time.time()
+    results = [index[bow] for bow in bows]
+    return results, time.time() - start
+
+if __name__ == '__main__':
+    program = Program()
+    program.main()
@@ -4,36 +4,32 @@ import argparse
 import json
 import os
 
-from gensim import corpora, similarities
+from gensim import corpora
 from nltk.tokenize import word_tokenize
 
 from analyzers import factory
-from corpus import fb_social_metrics, fb_trend, es_id_list
+from corpus import cached_corpus, fb_social_metrics, fb_trend, es_id_list
+from matching.inverted_index import InvertedIndex
+from matching.sharded_index import ShardedIndex
+from parallel import batching
 
 
 class Program:
     def __init__(self):
         analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
-        self._analyzers = [factory.get_analyzer(key) for key in analyzer_keys]
+        self._analyzer = factory.get_pipeline(analyzer_keys)
         self._filter_bow_ids = set()
 
     def main(self):
         self._parse_args()
         self._load_dictionary()
         self._load_index()
-        self._load_ordinals()
-        self._filter_dictionary()
-
-        loop_counter = 0
-        matches = []
-        for o in self._analyzed_corpus():
-            loop_counter += 1
-            sims = self._index[o['bow']]
-            matches.append({
-                'socialMetricId': o['id'],
-                'webpage': self._ordinals[sims[0][0]],
-                'score': sims[0][1]
-                })
+        try:
+            self._load_ordinals()
+            self._filter_dictionary()
+            matches = list(self._matches())
+        finally:
+            self._close_index()
         matches.sort(key=lambda x: x['score'], reverse=True)
 
         if self.args.fb_ids is not None:
@@ -46,6 +42,18 @@ class Program:
             for match in matches:
                 f.write('{}\t{}\t{}\n'.format(match['score'], match['socialMetricId'], match['webpage']))
 
+    # querying the index with a chunk of bows does one sparse matrix product per
+    # shard for the whole chunk instead of one per bow
+    def _matches(self):
+        for chunk in batching.batches(self._analyzed_corpus(), self.args.batch_size):
+            chunk_sims = self._index[[o['bow'] for o in chunk]]
+            for o, sims in zip(chunk, chunk_sims):
+                yield {
+                    'socialMetricId': o['id'],
+                    'webpage': self._ordinals[sims[0][0]],
+                    'score': sims[0][1]
+                    }
+
     def _analyzed_corpus(self):
         provider, fields = self._get_corpus_provider_and_fields()
 
@@ -84,12 +92,7 @@ class Program:
         return bow
 
     def _get_analyzed_tokens(self, string):
-        tokens = word_tokenize(string)
-
-        for analyzer in self._analyzers:
-            tokens = analyzer.analyze(tokens)
-
-        return tokens
+        return self._analyzer.analyze(word_tokenize(string))
 
     def _filter_bow(self, bow):
         return [x for x in bow if x[0] not in self._filter_bow_ids]
@@ -98,18 +101,25 @@ class Program:
         if self.args.fb_dimension == 'trendpage':
             fields = ['title', 'content']
             if self.args.fb_ids is None:
-                provider = fb_trend.FacebookTrends(self.args.fb_page)
+                provider = fb_trend.FacebookTrends(
+                    self.args.fb_page, batch_size=self.args.mget_batch_size, max_in_flight=self.args.mget_in_flight)
+                provider = self._cached(provider, 'trendpages')
             else:
                 provider = es_id_list.EsIdList(self.args.fb_ids, doc_type='trendpage')
         else:
             fields = ['description', 'name', 'message']
             if self.args.fb_ids is None:
-                provider = fb_social_metrics.FacebookSocialMetrics(self.args.fb_page)
+                provider = self._cached(fb_social_metrics.FacebookSocialMetrics(self.args.fb_page), 'social-metrics')
             else:
                 provider = es_id_list.EsIdList(self.args.fb_ids, doc_type='facebookSocialMetrics')
 
         return provider, fields
 
+    def _cached(self, provider, kind):
+        name = 'facebook-{}-{}'.format(kind, self.args.fb_page)
+        return cached_corpus.wrap(
+            provider, name, self.args.cache_dir, self.args.cache_ttl_hours, self.args.cache_max_mb)
+
     def _load_dictionary(self):
         dictionary_name = '{}.mm'.format(self._partition_key)
         fqn = os.path.join('out', 'dictionary', dictionary_name)
@@ -121,10 +131,18 @@ class Program:
         self._filter_bow_ids.add(self._dictionary.token2id['{__NUMBER__}'])
 
     def _load_index(self):
+        if self.args.backend == 'inverted':
+            fqn_index_name = os.path.join('out', 'index', '{}-inverted-index'.format(self._partition_key))
+            self._index = InvertedIndex.load(fqn_index_name)
+            return
+
         fqn_index_name = os.path.join('out', 'index', '{}-index'.format(self._partition_key))
-        self._index = similarities.Similarity.load(fqn_index_name)
-        self._index.output_prefix = fqn_index_name
-        self._index.check_moved()
+        self._index = ShardedIndex.load(fqn_index_name, self.args.shard_workers, output_prefix=fqn_index_name)
+
+    # stops the shard query processes
+    def _close_index(self):
+        if isinstance(self._index, ShardedIndex):
+            self._index.close()
 
     def _load_ordinals(self):
         fqn_ordinal_name = os.path.join('out', 'index', '{}-ordinal.js'.format(self._partition_key))
@@ -140,6 +158,16 @@ class Program:
         parser.add_argument('--fb_dimension', choices=['social_metric', 'trendpage'], default='trendpage')
         parser.add_argument('--dictionary_version', default='unabridged')
         parser.add_argument('--fb_ids', nargs='+')
+        parser.add_argument('--backend', choices=['exact', 'inverted'], default='exact',
+                            help='index built by gen_index.py with the same backend')
+        parser.add_argument('--shard_workers', type=int, default=1,
+                            help='processes querying the index shards in parallel, needs as many cores')
+        parser.add_argument('--batch_size', type=int, default=256, help='bows sent to the index per query')
+        parser.add_argument('--mget_batch_size', type=int, default=500, help='trendpages fetched per request')
+        parser.add_argument('--mget_in_flight', type=int, default=4, help='concurrent trendpage fetch requests')
+        parser.add_argument('--cache_dir', help='local document cache, fetched docs are replayed from it')
+        parser.add_argument('--cache_ttl_hours', type=float, default=168)
+        parser.add_argument('--cache_max_mb', type=int)
         self.args = parser.parse_args()
         self._partition_key = '{}-{}-{}'.format(
             self.args.customer_id, self.args.subdomain, self.args.dictionary_version)
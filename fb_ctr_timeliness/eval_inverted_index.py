@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy
+from gensim import models, similarities
+
+from matching.inverted_index import InvertedIndex
+
+
+class Program:
+    def main(self):
+        self._parse_args()
+        self._random = numpy.random.RandomState(self.args.seed)
+        # token frequencies follow zipf's law like the analyzed webpages
+        self._token_probabilities = 1 / numpy.arange(1, self.args.vocabulary + 1)
+        self._token_probabilities /= self._token_probabilities.sum()
+
+        docs = [self._random_bow() for _ in range(self.args.docs)]
+        queries = [self._random_bow() for _ in range(self.args.queries)]
+
+        inverted_index = InvertedIndex(self.args.vocabulary, num_best=10, weighting=self.args.weighting)
+        inverted_index.add_documents(docs)
+        inverted_index[queries[0]]
+
+        # the inverted index weights its queries itself, gensim is given tf-idf vectors
+        gensim_docs = docs
+        gensim_queries = queries
+        if self.args.weighting == 'tfidf':
+            tfidf = models.TfidfModel(docs)
+            gensim_docs = tfidf[docs]
+            gensim_queries = [tfidf[bow] for bow in queries]
+        with tempfile.TemporaryDirectory() as shard_dir:
+            gensim_index = similarities.Similarity(
+                os.path.join(shard_dir, 'shard'), gensim_docs, num_features=self.args.vocabulary, num_best=10)
+            gensim_single, gensim_single_seconds = _timed_queries(gensim_index, gensim_queries)
+            gensim_chunk, gensim_chunk_seconds = _timed_chunk(gensim_index, gensim_queries)
+
+        inverted_single, inverted_single_seconds = _timed_queries(inverted_index, queries)
+        inverted_chunk, inverted_chunk_seconds = _timed_chunk(inverted_index, queries)
+
+        report = {
+            'docs': self.args.docs,
+            'queries': len(queries),
+            'weighting': self.args.weighting,
+            'same_top_scores': _agreement(inverted_single, gensim_single),
+            'gensim_ms_per_query': 1000 * gensim_single_seconds / len(queries),
+            'gensim_chunk_ms_per_query': 1000 * gensim_chunk_seconds / len(queries),
+            'inverted_ms_per_query': 1000 * inverted_single_seconds / len(queries),
+            'inverted_chunk_ms_per_query': 1000 * inverted_chunk_seconds / len(queries)
+        }
+        print(json.dumps(report, sort_keys=True, indent=2))
+
+    def _random_bow(self):
+        token_ids, counts = numpy.unique(
+            self._random.choice(self.args.vocabulary, self.args.doc_tokens, p=self._token_probabilities),
+            return_counts=True)
+        return list(zip(token_ids.tolist(), counts.astype(float).tolist()))
+
+    def _parse_args(self):
+        parser = argparse.ArgumentParser('measures latency of the inverted index against a gensim similarity index')
+        parser.add_argument('--docs', type=int, default=50000)
+        parser.add_argument('--doc_tokens', type=int, default=300, help='tokens drawn per doc and query')
+        parser.add_argument('--vocabulary', type=int, default=20000)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--weighting', choices=['tfidf', 'raw'], default='tfidf')
+        parser.add_argument('--seed', type=int, default=0)
+        self.args = parser.parse_args()
+
+
+def _timed_queries(index, bows):
+    start = time.time()
+    results = [index[bow] for bow in bows]
+    return results, time.time() - start
+
+
+def _timed_chunk(index, bows):
+    start = time.time()
+    results = index[bows]
+    return results, time.time() - start
+
+
+def _agreement(results, expected_results):
+    same = 0
+    for result, expected in zip(results, expected_results):
+        if len(result) == len(expected) and all(abs(r[1] - e[1]) < 1e-4 for r, e in zip(result, expected)):
+            same += 1
+    return same / max(len(results), 1)
+
+if __name__ == '__main__':
+    program = Program()
+    program.main()
@@ -3,17 +3,16 @@
 import argparse
 import codecs
 import csv
-import elasticsearch
 import json
-import numpy
 import os
 
-from scipy.sparse import coo_matrix
+from corpus import es_client
+from matching.esa_signature import EsaSignature
 
 
 class Program:
     def __init__(self):
-        self._es = elasticsearch.Elasticsearch('signals-es-access-1.test.inspcloud.com')
+        self._es = es_client.get_client()
 
     def main(self):
         self._parse_args()
@@ -36,30 +35,22 @@ class Program:
                 esa_sig = doc['_source']['esaSignature']
                 trendpages = self._get_es_trendpages(esa_sig)
                 if 0 < trendpages['hits']['total']:
-                    hit = trendpages['hits']['hits'][0]
-                    first_similarity = _get_cosine_similarity(esa_sig, hit['_source']['esaSignature'])
+                    hits = trendpages['hits']['hits']
+                    webpage_sig = EsaSignature.parse(esa_sig)
+                    similarities = webpage_sig.cosine_many(
+                        [EsaSignature.parse(hit['_source']['esaSignature']) for hit in hits])
                     example['first_hit'] = {
-                        'trendpage':  hit['_id'],
-                        'similarity': first_similarity,
+                        'trendpage':  hits[0]['_id'],
+                        'similarity': float(similarities[0]),
                         'hit': 1
                     }
 
-                    hit_counter = 1
-                    best_hit = {
-                        'trendpage':  hit['_id'],
-                        'similarity': first_similarity,
-                        'hit': 1
+                    best = int(similarities.argmax())
+                    example['best_hit'] = {
+                        'trendpage': hits[best]['_id'],
+                        'similarity': float(similarities[best]),
+                        'hit': best + 1
                     }
-                    for hit in trendpages['hits']['hits'][1:]:
-                        hit_counter += 1
-                        similarity = _get_cosine_similarity(esa_sig, hit['_source']['esaSignature'])
-                        if best_hit['similarity'] < similarity:
-                            best_hit = {
-                                'trendpage': hit['_id'],
-                                'similarity': similarity,
-                                'hit': hit_counter
-                            }
-                    example['best_hit'] = best_hit
 
                 examples.append(example)
 
@@ -91,30 +82,6 @@ class Program:
         self.args = parser.parse_args()
 
 
-def _get_cosine_similarity(sig_one, sig_two):
-    meta_one = _parse_esa_signature(sig_one)
-    meta_two = _parse_esa_signature(sig_two)
-    max_row_index = max(max(meta_one['row']), max(meta_two['row']))
-    shape = (max_row_index+1, 1)
-    vector_one = coo_matrix((meta_one['data'], (meta_one['row'], meta_one['col'])), shape=shape)
-    vector_two = coo_matrix((meta_two['data'], (meta_two['row'], meta_two['col'])), shape=shape)
-    inner = vector_two.transpose().dot(vector_one)
-    magnitude_one = numpy.sqrt(vector_one.transpose().dot(vector_one))
-    magnitude_two = numpy.sqrt(vector_two.transpose().dot(vector_two))
-    similarity = inner / (magnitude_one * magnitude_two)
-    return similarity[0, 0]
-
-
-def _parse_esa_signature(sig):
-    sig = sig.strip()
-    sig = sig.split('\t')
-    row = sig[::2]
-    row = [int(x) for x in row]
-    col = numpy.zeros(len(row), dtype=numpy.int32)
-    data = sig[1::2]
-    data = [float(x) for x in data]
-    return {'row': row, 'col': col, 'data': data}
-
 if __name__ == '__main__':
     program = Program()
     program.main()
@@ -7,64 +7,139 @@ from gensim import corpora
 from nltk.tokenize import word_tokenize
 from urllib.parse import urlparse
 
-from analyzers import factory
-from corpus import es_customer_webpages
+from corpus import cached_corpus, es_customer_webpages, token_corpus
+from parallel import analysis, batching, stages
 
 
 class Program:
     def __init__(self):
-        analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
-        self._analyzers = [factory.get_analyzer(key) for key in analyzer_keys]
+        self._analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
 
     def main(self):
         self._parse_args()
 
+        if self.args.token_corpus:
+            batches = self._token_corpus_batches()
+        else:
+            batches = self._analyzed_batches()
+
         dictionaries = {}
+        for batch_dictionaries in batches:
+            for sub_domain, dictionary in batch_dictionaries.items():
+                if sub_domain not in dictionaries:
+                    dictionaries[sub_domain] = dictionary
+                else:
+                    _merge_dictionary(dictionaries[sub_domain], dictionary)
 
-        customer_webpages = es_customer_webpages.CustomerWebpages(self.args.customer_id)
-        loop_counter = 0
-        for doc in customer_webpages.corpus():
-            loop_counter += 1
+        for k, v in dictionaries.items():
+            dictionary_name = '{}-{}-unabridged.mm'.format(self.args.customer_id, k)
+            v.save(os.path.join('out', 'dictionary', dictionary_name))
 
-            sub_domain = 'all'
-            if self.args.parse_subdomain:
-                url = urlparse(doc['_id'])
-                if url.hostname is None:
-                    continue
+    # the token corpus is fingerprinted with the same options the analyzers are built with
+    def _analyzer_options(self):
+        return {'porterstem': {'cache_file': self.args.stem_cache}}
 
-                hostname_tokens = url.hostname.split('.')
-                if len(hostname_tokens) < 3:
-                    continue
+    # batches are analyzed in order and merged in order, so token ids match a serial build.
+    # the scroll runs in its own thread so fetching overlaps with analysis
+    def _analyzed_batches(self):
+        options = self._analyzer_options()
+        docs = batching.batches(self._subdomain_docs(), self.args.batch_size)
 
-                sub_domain = hostname_tokens[-3]
+        yield from stages.Stages(docs, _build_dictionaries, self.args.workers,
+                                 analysis.init_worker, (self._analyzer_keys, options),
+                                 queue_size=self.args.queue_size, name='gen_dictionary')
+        if self.args.workers <= 1:
+            analysis.get_analyzer().close()
+
+    def _token_corpus_batches(self):
+        tokens = token_corpus.TokenCorpus(
+            'webpages-{}'.format(self.args.customer_id), self._analyzer_keys, self._analyzer_options())
+        if not tokens.exists():
+            raise FileNotFoundError('no token corpus for the current analyzers, run gen_token_corpus.py')
+
+        dictionaries = {}
+        for doc_id, fields in tokens.corpus():
+            sub_domain = self._get_sub_domain(doc_id)
+            if sub_domain is None:
+                continue
 
             if sub_domain not in dictionaries:
                 dictionaries[sub_domain] = corpora.Dictionary()
 
+            for field_tokens in fields.values():
+                dictionaries[sub_domain].add_documents(documents=[field_tokens])
+
+        yield dictionaries
+
+    def _subdomain_docs(self):
+        customer_webpages = cached_corpus.wrap(
+            es_customer_webpages.CustomerWebpages(self.args.customer_id),
+            'webpages-{}'.format(self.args.customer_id),
+            self.args.cache_dir, self.args.cache_ttl_hours, self.args.cache_max_mb)
+        loop_counter = 0
+        for doc in customer_webpages.corpus():
+            loop_counter += 1
+
+            sub_domain = self._get_sub_domain(doc['_id'])
+            if sub_domain is None:
+                continue
+
             fields = ['title', 'content']
-            for field in fields:
-                field_value = doc['_source'].get(field, None)
-                if field_value is not None:
-                    tokens = self.get_analyzed_tokens(field_value)
-                    dictionaries[sub_domain].add_documents(documents=[tokens])
+            yield sub_domain, [doc['_source'].get(field, None) for field in fields]
 
-        for k, v in dictionaries.items():
-            dictionary_name = '{}-{}-unabridged.mm'.format(self.args.customer_id, k)
-            v.save(os.path.join('out', 'dictionary', dictionary_name))
+    def _get_sub_domain(self, doc_id):
+        if not self.args.parse_subdomain:
+            return 'all'
 
-    def get_analyzed_tokens(self, string):
-        tokens = word_tokenize(string)
+        url = urlparse(doc_id)
+        if url.hostname is None:
+            return None
 
-        for analyzer in self._analyzers:
-            tokens = analyzer.analyze(tokens)
+        hostname_tokens = url.hostname.split('.')
+        if len(hostname_tokens) < 3:
+            return None
 
-        return tokens
+        return hostname_tokens[-3]
 
     def _parse_args(self):
         parser = argparse.ArgumentParser("creates an unabridged dictionary from a customer's webpage corpus")
         parser.add_argument('--customer_id', required=True, help='placeholder')
         parser.add_argument('--parse_subdomain', type=bool, required=False, default=False)
+        parser.add_argument('--stem_cache', help='json file used to preload and persist the stemming cache, needs --workers 1')
+        parser.add_argument('--workers', type=int, default=1, help='number of analyzer processes')
+        parser.add_argument('--batch_size', type=int, default=100, help='docs handed to a worker at a time')
+        parser.add_argument('--queue_size', type=int, default=16, help='fetched batches buffered ahead of analysis')
+        parser.add_argument('--cache_dir', help='local document cache, fetched docs are replayed from it')
+        parser.add_argument('--cache_ttl_hours', type=float, default=168)
+        parser.add_argument('--cache_max_mb', type=int)
+        parser.add_argument('--token_corpus', action='store_true', help='read tokens written by gen_token_corpus.py')
         self.args = parser.parse_args()
+        # pool workers each fill their own copy of the cache, which is never written back
+        if self.args.stem_cache is not None and 1 < self.args.workers:
+            parser.error('--stem_cache is only saved with --workers 1')
+
+
+def _build_dictionaries(batch):
+    analyzer = analysis.get_analyzer()
+    dictionaries = {}
+    for sub_domain, field_values in batch:
+        if sub_domain not in dictionaries:
+            dictionaries[sub_domain] = corpora.Dictionary()
+
+        for field_value in field_values:
+            if field_value is not None:
+                tokens = analyzer.analyze(word_tokenize(field_value))
+                dictionaries[sub_domain].add_documents(documents=[tokens])
+
+    return dictionaries
+
+
+def _merge_dictionary(dictionary, other):
+    transformer = dictionary.merge_with(other)
+    # merge_with() carries over document frequencies but not collection frequencies
+    for other_id, cf in getattr(other, 'cfs', {}).items():
+        new_id = transformer.old2new[other_id]
+        dictionary.cfs[new_id] = dictionary.cfs.get(new_id, 0) + cf
 
 if __name__ == '__main__':
     program = Program()
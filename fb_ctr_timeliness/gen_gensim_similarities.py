@@ -1,129 +1,187 @@
 #!/usr/bin/env python3
 
 import argparse
-import elasticsearch
 import json
 import os
 import sys
 
+from elasticsearch.helpers import scan
 from gensim import corpora, similarities
 from nltk.tokenize import word_tokenize
 
 from analyzers import factory
+from corpus import es_client, mget
+from matching.inverted_index import InvertedIndex
+from matching.lsh_index import LshIndex
+from matching.sharded_index import load_appendable, separate_shard_arrays
+from parallel import batching
 
 
 class Program:
     def __init__(self):
-        self._es = elasticsearch.Elasticsearch('signals-es-access-2.test.inspcloud.com')
+        self._es = es_client.get_client()
         analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
-        self._analyzers = [factory.get_analyzer(key) for key in analyzer_keys]
+        self._analyzer = factory.get_pipeline(analyzer_keys)
 
     def main(self):
         self._parse_args()
         self._load_gensim_dicts()
-        index = similarities.Similarity(
-            os.path.join('out', 'index', '20160608', 'shard'), [], num_features=1000, num_best=10)
-        indexed_trend_ids = []
-        for doc_bow in self._corpus_generator():
-            index.add_documents([doc_bow['bow']])
-            indexed_trend_ids.append(doc_bow['id'])
-        index.save(fname=os.path.join('out', 'gensim-similarity-20160608-index'))
-        indexed_trends = {'ids': indexed_trend_ids}
-        with open(os.path.join('out', 'gensim-similarity-20160608-ordinal.js'), 'w') as f:
+        with open(os.path.join('out', 'trend-ids.js')) as f:
+            trend_ids = json.load(f)['ids']
+
+        fqn_ordinal_name = os.path.join('out', 'gensim-similarity-20160608-ordinal.js')
+        if self.args.incremental and os.path.exists(fqn_ordinal_name):
+            with open(fqn_ordinal_name) as f:
+                indexed_trends = json.load(f)
+            index = self._load_index()
+        else:
+            indexed_trends = {'ids': []}
+            index = self._create_index()
+
+        # trends stay in the index once added, the ones no longer listed are
+        # tombstoned and skipped by the matchers
+        indexed_trend_ids = indexed_trends['ids']
+        known_trend_ids = set(indexed_trend_ids)
+        new_trend_ids = [trend_id for trend_id in trend_ids if trend_id not in known_trend_ids]
+        tombstones = sorted(known_trend_ids - set(trend_ids))
+        print('{} indexed, {} new, {} tombstoned'.format(
+            len(indexed_trend_ids), len(new_trend_ids), len(tombstones)), file=sys.stderr)
+
+        for doc_bows in batching.batches(self._corpus_generator(new_trend_ids), 1000):
+            index.add_documents([doc_bow['bow'] for doc_bow in doc_bows])
+            indexed_trend_ids.extend(doc_bow['id'] for doc_bow in doc_bows)
+        self._save_index(index)
+        indexed_trends = {'ids': indexed_trend_ids, 'tombstones': tombstones}
+        with open(fqn_ordinal_name, 'w') as f:
             json.dump(indexed_trends, f)
 
-    def _corpus_generator(self):
-        with open(os.path.join('out', 'trend-ids.js')) as f:
-            trends = json.load(f)
+    def _create_index(self):
+        self._first_new_shard = 0
+        if self.args.backend == 'lsh':
+            return LshIndex(len(self._title_content_dict), num_best=10,
+                            num_tables=self.args.lsh_tables, num_bits=self.args.lsh_bits)
+        if self.args.backend == 'inverted':
+            return InvertedIndex(len(self._title_content_dict), num_best=10)
+
+        return similarities.Similarity(
+            os.path.join('out', 'index', '20160608', 'shard'), [], num_features=1000, num_best=10)
+
+    def _load_index(self):
+        if self.args.backend == 'lsh':
+            return LshIndex.load(self._index_name())
+        if self.args.backend == 'inverted':
+            return InvertedIndex.load(self._index_name())
+
+        # full shards are never rewritten, so they keep their separated arrays
+        index = load_appendable(self._index_name())
+        self._first_new_shard = sum(1 for shard in index.shards if len(shard) == index.shardsize)
+        return index
+
+    def _save_index(self, index):
+        index.save(self._index_name())
+        if self.args.backend == 'exact':
+            separate_shard_arrays(index, self._first_new_shard)
+
+    def _index_name(self):
+        if self.args.backend == 'lsh':
+            return os.path.join('out', 'lsh-20160608-index')
+        if self.args.backend == 'inverted':
+            return os.path.join('out', 'inverted-20160608-index')
+        return os.path.join('out', 'gensim-similarity-20160608-index')
+
+    def _corpus_generator(self, trend_ids):
+        trend_urls = self._get_trend_urls(trend_ids)
+        page_bows = self._get_page_bows({url for urls in trend_urls.values() for url in urls})
+
         loop_counter = 0
-        for trend_id in trends['ids']:
+        for trend_id in trend_ids:
             loop_counter += 1
 
-            print('{}/{} {}'.format(loop_counter, len(trends['ids']), trend_id), file=sys.stderr)
+            print('{}/{} {}'.format(loop_counter, len(trend_ids), trend_id), file=sys.stderr)
 
-            trend_bow = self._get_trend_bow(trend_id)
+            trend_bow = self._get_trend_bow(trend_urls.get(trend_id, ()), page_bows)
             if trend_bow is None:
                 continue
 
             yield {'id': trend_id, 'bow': trend_bow}
 
-    def _get_trend_bow(self, trend_id):
-        docs = self._get_es_trend_pages_by_trend_id(trend_id)
-        if docs is None:
+    # one scan of the time series per chunk of trend ids instead of a search per trend,
+    # so an incremental run only reads the series of its new trends
+    def _get_trend_urls(self, trend_ids):
+        trend_urls = {}
+        for chunk in batching.batches(trend_ids, self.args.trend_id_chunk_size):
+            wanted_trend_ids = set(chunk)
+            for hit in scan(self._es,
+                            query={'query': {'bool': {'filter': {'terms': {'trendId': chunk}}}}},
+                            index='google-trends-aggregator-20160207-000007',
+                            doc_type='googleTrendsTimeSeries',
+                            _source=['trendId', 'trendUrl']):
+                trend_id = hit['_source'].get('trendId')
+                url = hit['_source'].get('trendUrl')
+                if trend_id in wanted_trend_ids and url is not None:
+                    trend_urls.setdefault(trend_id, set()).add(url)
+
+        print('{} trends have {} distinct trend pages'.format(
+            len(trend_urls), len({url for urls in trend_urls.values() for url in urls})), file=sys.stderr)
+        return trend_urls
+
+    # trend pages are shared by many trends, so each one is fetched and analyzed
+    # once. trendpage docs are keyed by their url.
+    def _get_page_bows(self, urls):
+        page_bows = {}
+        docs = mget.mget(self._es, sorted(urls), 'signals_read', 'trendpage', ['title', 'content'],
+                         batch_size=self.args.mget_batch_size, max_in_flight=self.args.mget_in_flight)
+        for doc in docs:
+            page_bows[doc['_id']] = self._get_page_bow(doc['_source'])
+        return page_bows
+
+    def _get_page_bow(self, source):
+        title = source.get('title')
+        content = source.get('content')
+        if title is None and content is None:
             return None
-        trend_bow = {}
-        for hit in docs['hits']['hits']:
-            title = hit['_source']['title']
-            content = hit['_source']['content']
-            if title is None and content is None:
-                return None
-            txt = ''
-            if title is not None:
-                txt += title
-            if content is not None:
-                txt += ' ' + content
-            txt_tokens = self._get_analyzed_tokens(txt)
-            if len(txt_tokens) == 0:
-                return None
-            hit_bow = self._title_content_dict.doc2bow(txt_tokens)
-            if len(hit_bow) == 0:
-                return None
-            for t in hit_bow:
-                if t[0] in trend_bow:
-                    trend_bow[t[0]] += t[1]
-                else:
-                    trend_bow[t[0]] = t[1]
-
-        trend_bow = [(k, v) for k, v in trend_bow.items()]
-        return trend_bow
-
-    def _get_es_trend_pages_by_trend_id(self, trend_id):
-        google_trend_docs = self._get_es_google_trend(trend_id)
-        urls = list({hit['_source']['trendUrl'] for hit in google_trend_docs['hits']['hits']
-                     if hit['_source']['trendUrl'] is not None})
-        return self._get_es_trend_pages_by_urls(urls)
-
-    def _get_es_google_trend(self, trend_id):
-        query = {
-            'size': 1000,
-            'query': {
-                'match': {'trendId': trend_id}
-            }
-        }
-
-        return self._es.search(index='google-trends-aggregator-20160207-000007',
-                               doc_type='googleTrendsTimeSeries',
-                               body=query)
-
-    def _get_es_trend_pages_by_urls(self, urls):
-        if urls is None or len(urls) == 0:
+        txt = ''
+        if title is not None:
+            txt += title
+        if content is not None:
+            txt += ' ' + content
+        txt_tokens = self._get_analyzed_tokens(txt)
+        if len(txt_tokens) == 0:
+            return None
+        page_bow = self._title_content_dict.doc2bow(txt_tokens)
+        if len(page_bow) == 0:
             return None
+        return page_bow
 
-        query = {
-            'size': 1000,
-            'query': {
-                'terms': {'url': urls}
-            }
-        }
+    # a trend is left out when none of its pages exist or any of them has no usable text
+    def _get_trend_bow(self, urls, page_bows):
+        bows = [page_bows[url] for url in urls if url in page_bows]
+        if len(bows) == 0 or any(bow is None for bow in bows):
+            return None
 
-        return self._es.search(index='signals_read',
-                               doc_type='trendpage',
-                               body=query,
-                               _source_include=['title', 'content'])
+        trend_bow = {}
+        for bow in bows:
+            for token_id, count in bow:
+                trend_bow[token_id] = trend_bow.get(token_id, 0) + count
+
+        return list(trend_bow.items())
 
     def _load_gensim_dicts(self):
         self._title_content_dict = corpora.Dictionary.load(os.path.join('out', 'title-content-dict-1000-tokens.mm'))
 
     def _get_analyzed_tokens(self, string):
-        tokens = word_tokenize(string)
-
-        for analyzer in self._analyzers:
-            tokens = analyzer.analyze(tokens)
-
-        return tokens
+        return self._analyzer.analyze(word_tokenize(string))
 
     def _parse_args(self):
         parser = argparse.ArgumentParser('caches the gensim similarity index of the trend bow')
+        parser.add_argument('--backend', choices=['exact', 'lsh', 'inverted'], default='exact')
+        parser.add_argument('--incremental', action='store_true',
+                            help='add new trends to the saved index and tombstone the removed ones')
+        parser.add_argument('--trend_id_chunk_size', type=int, default=1000, help='trend ids per time series scan')
+        parser.add_argument('--mget_batch_size', type=int, default=500, help='trend pages fetched per request')
+        parser.add_argument('--mget_in_flight', type=int, default=4, help='concurrent trend page fetch requests')
+        parser.add_argument('--lsh_tables', type=int, default=8, help='more tables raise recall and query cost')
+        parser.add_argument('--lsh_bits', type=int, default=12, help='more bits shrink buckets and lower recall')
         self.args = parser.parse_args()
 
 if __name__ == '__main__':
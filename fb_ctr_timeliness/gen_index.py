@@ -8,15 +8,20 @@ import sys
 from gensim import corpora, similarities
 from nltk.tokenize import word_tokenize
 
-from analyzers import factory
-from corpus import customer_subdomain, es_customer_webpages
+from corpus import cached_corpus, customer_subdomain, es_customer_webpages, token_corpus
+from matching.inverted_index import InvertedIndex
+from matching.sharded_index import separate_shard_arrays
+from parallel import analysis, batching, stages
+
+# set in every pool worker by _init_worker
+_dictionary = None
 
 
 class Program:
     def __init__(self):
-        analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
-        self._analyzers = [factory.get_analyzer(key) for key in analyzer_keys]
+        self._analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
         self._indexed_urls = []
+        self._skipped_urls = []
 
     # the saved index contains the relative path of the shards. So create everything
     # in current directory and then move to final directory.
@@ -24,86 +29,218 @@ class Program:
         self._parse_args()
         self._load_dictionary()
 
-        shard_prefix = '{}-shard'.format(self._partition_key)
-        index = similarities.Similarity(
-            shard_prefix, self._analyzed_corpus(), num_features=len(self._dictionary), num_best=10)
+        fqn_index_name = self._index_name()
+        fqn_checkpoint_name = '{}-checkpoint.js'.format(self._partition_key)
+        if self.args.resume and os.path.exists(fqn_checkpoint_name):
+            index = self._load_checkpoint(fqn_index_name, fqn_checkpoint_name)
+        else:
+            index = self._create_index()
 
-        fqn_index_name = '{}-index'.format(self._partition_key)
-        index.save(fname=fqn_index_name)
+        # a full shard has just been written to disk whenever the ordinal count
+        # reaches a multiple of the shard size, so that is when we checkpoint
+        for doc_id, bow in self._analyzed_corpus():
+            if bow is None:
+                self._skipped_urls.append(doc_id)
+                continue
+
+            index.add_documents([bow])
+            self._indexed_urls.append(doc_id)
+            if len(self._indexed_urls) % self.args.shard_size == 0:
+                self._save_checkpoint(index, fqn_index_name, fqn_checkpoint_name)
+
+        index.save(fqn_index_name)
+        if self.args.backend == 'exact':
+            separate_shard_arrays(index)
+            index.close_shard()
 
         ordinal_ids = {'ids': self._indexed_urls}
         fqn_ordinal_name = '{}-ordinal.js'.format(self._partition_key)
         with open(fqn_ordinal_name, 'w') as f:
             json.dump(ordinal_ids, f)
 
-        index.close_shard()
+        if os.path.exists(fqn_checkpoint_name):
+            os.remove(fqn_checkpoint_name)
         for item in os.listdir('.'):
             if item.startswith(self._partition_key):
                 os.rename(item, os.path.join('out', 'index', item))
 
+    def _index_name(self):
+        if self.args.backend == 'inverted':
+            return '{}-inverted-index'.format(self._partition_key)
+        return '{}-index'.format(self._partition_key)
+
+    def _create_index(self):
+        if self.args.backend == 'inverted':
+            return InvertedIndex(len(self._dictionary), num_best=10)
+
+        shard_prefix = '{}-shard'.format(self._partition_key)
+        return similarities.Similarity(
+            shard_prefix, None, num_features=len(self._dictionary), num_best=10, shardsize=self.args.shard_size)
+
+    # the token corpus is fingerprinted with the same options the analyzers are built with
+    def _analyzer_options(self):
+        return {'porterstem': {'cache_file': self.args.stem_cache}}
+
     def _analyzed_corpus(self):
+        if self.args.token_corpus:
+            yield from self._token_corpus_bows()
+            return
+
+        options = self._analyzer_options()
+        initargs = (self._analyzer_keys, options, self._fqn_dictionary_name)
+        docs = batching.batches(self._unprocessed_docs(), self.args.batch_size)
+
+        # the fetch runs in its own thread so scroll or mget latency overlaps with analysis
+        for batch in stages.Stages(docs, _get_batch_bows, self.args.workers, _init_worker, initargs,
+                                   queue_size=self.args.queue_size, name='gen_index'):
+            yield from batch
+        if self.args.workers <= 1:
+            analysis.get_analyzer().close()
+
+    # the token corpus holds the customer's whole scan, a subdomain is picked out by its url list
+    def _token_corpus_bows(self):
+        tokens = token_corpus.TokenCorpus(
+            'webpages-{}'.format(self.args.customer_id), self._analyzer_keys, self._analyzer_options())
+        if not tokens.exists():
+            raise FileNotFoundError('no token corpus for the current analyzers, run gen_token_corpus.py')
+
+        subdomain_urls = None
+        if self.args.subdomain != 'all':
+            file_name = '{}-{}.js'.format(self.args.customer_id, self.args.subdomain)
+            with open(os.path.join('out', 'corpus', file_name)) as f:
+                subdomain_urls = set(json.load(f)['urls'])
+
+        processed_urls = self._processed_urls()
+        for doc_id, fields in tokens.corpus():
+            if doc_id in processed_urls or (subdomain_urls is not None and doc_id not in subdomain_urls):
+                continue
+
+            txt_tokens = [token for field_tokens in fields.values() for token in field_tokens]
+            if len(txt_tokens) == 0:
+                yield doc_id, None
+                continue
+
+            bow = self._dictionary.doc2bow(txt_tokens)
+            yield doc_id, bow if len(bow) != 0 else None
+
+    def _unprocessed_docs(self):
         if self.args.subdomain == 'all':
             provider = es_customer_webpages.CustomerWebpages(self.args.customer_id)
+            cache_name = 'webpages-{}'.format(self.args.customer_id)
         else:
-            provider = customer_subdomain.CustomerSubdomain(self.args.customer_id, self.args.subdomain)
-        loop_counter = 0
+            provider = customer_subdomain.CustomerSubdomain(
+                self.args.customer_id, self.args.subdomain,
+                batch_size=self.args.mget_batch_size, max_in_flight=self.args.mget_in_flight)
+            cache_name = 'webpages-{}-{}'.format(self.args.customer_id, self.args.subdomain)
+        provider = cached_corpus.wrap(
+            provider, cache_name, self.args.cache_dir, self.args.cache_ttl_hours, self.args.cache_max_mb)
+
+        processed_urls = self._processed_urls()
         for doc in provider.corpus():
-            loop_counter += 1
-            print('{} {}'.format(loop_counter, doc['_id']), file=sys.stderr)
-
-            bow = self._get_bow(doc)
-            if bow is None:
+            if doc['_id'] in processed_urls:
                 continue
 
-            self._indexed_urls.append(doc['_id'])
-            yield bow
+            yield doc['_id'], doc['_source']
 
-    def _get_bow(self, doc):
-        if doc is None or len(doc['_source']) == 0:
-            return None
+    # scroll order is not stable between runs, so resumed builds skip by id
+    def _processed_urls(self):
+        return set(self._indexed_urls) | set(self._skipped_urls)
 
-        fields = ['title', 'content']
-        field_data = []
-        for field in fields:
-            value = doc['_source'].get(field)
-            if value is None:
-                continue
-            field_data.append(value)
+    def _save_checkpoint(self, index, fqn_index_name, fqn_checkpoint_name):
+        index.save(fqn_index_name)
+
+        checkpoint = {
+            'ids': self._indexed_urls,
+            'skipped': self._skipped_urls,
+            'last_id': self._indexed_urls[-1]
+        }
+        tmp_name = '{}.tmp'.format(fqn_checkpoint_name)
+        with open(tmp_name, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_name, fqn_checkpoint_name)
 
-        txt = ' '.join(field_data)
+        print('checkpoint {} indexed {} skipped, last {}'.format(
+            len(self._indexed_urls), len(self._skipped_urls), checkpoint['last_id']), file=sys.stderr)
 
-        txt_tokens = self._get_analyzed_tokens(txt)
-        if len(txt_tokens) == 0:
-            return None
+    def _load_checkpoint(self, fqn_index_name, fqn_checkpoint_name):
+        with open(fqn_checkpoint_name) as f:
+            checkpoint = json.load(f)
+        self._indexed_urls = checkpoint['ids']
+        self._skipped_urls = checkpoint['skipped']
 
-        bow = self._dictionary.doc2bow(txt_tokens)
-        if len(bow) == 0:
-            return None
+        print('resuming after {} indexed {} skipped, last {}'.format(
+            len(self._indexed_urls), len(self._skipped_urls), checkpoint['last_id']), file=sys.stderr)
 
-        return bow
+        if self.args.backend == 'inverted':
+            return InvertedIndex.load(fqn_index_name)
+        return similarities.Similarity.load(fqn_index_name)
 
     def _load_dictionary(self):
         dictionary_name = '{}.mm'.format(self._partition_key)
-        fqn = os.path.join('out', 'dictionary', dictionary_name)
-        self._dictionary = corpora.Dictionary.load(fqn)
-
-    def _get_analyzed_tokens(self, string):
-        tokens = word_tokenize(string)
-
-        for analyzer in self._analyzers:
-            tokens = analyzer.analyze(tokens)
-
-        return tokens
+        self._fqn_dictionary_name = os.path.join('out', 'dictionary', dictionary_name)
+        self._dictionary = corpora.Dictionary.load(self._fqn_dictionary_name)
 
     def _parse_args(self):
         parser = argparse.ArgumentParser('generates the gensim index')
         parser.add_argument('--customer_id', required=True)
         parser.add_argument('--subdomain', required=True)
         parser.add_argument('--dictionary_version', default='unabridged')
+        parser.add_argument('--backend', choices=['exact', 'inverted'], default='exact',
+                            help='sharded gensim similarity or posting lists with pruned top-k')
+        parser.add_argument('--stem_cache', help='json file used to preload and persist the stemming cache, needs --workers 1')
+        parser.add_argument('--workers', type=int, default=1, help='number of analyzer processes')
+        parser.add_argument('--batch_size', type=int, default=100, help='docs handed to a worker at a time')
+        parser.add_argument('--queue_size', type=int, default=16, help='fetched batches buffered ahead of analysis')
+        parser.add_argument('--shard_size', type=int, default=32768, help='docs per index shard and checkpoint')
+        parser.add_argument('--mget_batch_size', type=int, default=500, help='subdomain docs fetched per request')
+        parser.add_argument('--mget_in_flight', type=int, default=4, help='concurrent subdomain fetch requests')
+        parser.add_argument('--token_corpus', action='store_true', help='read tokens written by gen_token_corpus.py')
+        parser.add_argument('--resume', action='store_true', help='continue from the last completed shard')
+        parser.add_argument('--cache_dir', help='local document cache, fetched docs are replayed from it')
+        parser.add_argument('--cache_ttl_hours', type=float, default=168)
+        parser.add_argument('--cache_max_mb', type=int)
         self.args = parser.parse_args()
+        # pool workers each fill their own copy of the cache, which is never written back
+        if self.args.stem_cache is not None and 1 < self.args.workers:
+            parser.error('--stem_cache is only saved with --workers 1')
         self._partition_key = '{}-{}-{}'.format(
             self.args.customer_id, self.args.subdomain, self.args.dictionary_version)
 
+
+def _init_worker(analyzer_keys, options, fqn_dictionary_name):
+    global _dictionary
+    analysis.init_worker(analyzer_keys, options)
+    _dictionary = corpora.Dictionary.load(fqn_dictionary_name)
+
+
+def _get_batch_bows(batch):
+    return [(doc_id, _get_bow(source)) for doc_id, source in batch]
+
+
+def _get_bow(source):
+    if source is None or len(source) == 0:
+        return None
+
+    fields = ['title', 'content']
+    field_data = []
+    for field in fields:
+        value = source.get(field)
+        if value is None:
+            continue
+        field_data.append(value)
+
+    txt = ' '.join(field_data)
+
+    txt_tokens = analysis.get_analyzer().analyze(word_tokenize(txt))
+    if len(txt_tokens) == 0:
+        return None
+
+    bow = _dictionary.doc2bow(txt_tokens)
+    if len(bow) == 0:
+        return None
+
+    return bow
+
 if __name__ == '__main__':
     program = Program()
     program.main()
@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
-import elasticsearch
 import json
 import os
 
-from elasticsearch.helpers import scan
 from urllib.parse import urlparse
 
+from corpus import es_client
+from corpus.sliced_scan import sliced_scan
+
 
 class Program:
     def main(self):
@@ -18,9 +19,10 @@ class Program:
         query = {
             'query': {'match': {'customerId': 'howstuffworks'}}
         }
-        es = elasticsearch.Elasticsearch('signals-es-access-2.test.inspcloud.com')
+        es = es_client.get_client()
         loop_counter = 0
-        for doc in scan(es, query=query, index='signals_read', doc_type='webpage', _source=False):
+        for doc in sliced_scan(es, query=query, index='signals_read', doc_type='webpage',
+                               slices=self.args.slices, _source=False):
             loop_counter += 1
 
             url = urlparse(doc['_id'])
@@ -47,6 +49,7 @@ class Program:
     def _parse_args(self):
         parser = argparse.ArgumentParser('produces json files of subdomain urls by scanning es')
         # parser.add_argument('--foo', required=True, help='placeholder')
+        parser.add_argument('--slices', type=int, help='concurrent sliced scrolls, needs elasticsearch 5+')
         self.args = parser.parse_args()
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import argparse
+import multiprocessing
+
+from nltk.tokenize import word_tokenize
+
+from corpus import cached_corpus, es_customer_webpages, token_corpus
+from parallel import analysis, batching
+
+
+class Program:
+    def __init__(self):
+        self._analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
+
+    def main(self):
+        self._parse_args()
+
+        tokens = token_corpus.TokenCorpus(
+            'webpages-{}'.format(self.args.customer_id), self._analyzer_keys, self._analyzer_options())
+        tokens.write(self._analyzed_docs())
+
+    # the token corpus is fingerprinted with the same options the analyzers are built with
+    def _analyzer_options(self):
+        return {'porterstem': {'cache_file': self.args.stem_cache}}
+
+    def _analyzed_docs(self):
+        options = self._analyzer_options()
+        docs = batching.batches(self._docs(), self.args.batch_size)
+
+        if self.args.workers <= 1:
+            analysis.init_worker(self._analyzer_keys, options)
+            for batch in map(_analyze_batch, docs):
+                yield from batch
+            analysis.get_analyzer().close()
+            return
+
+        with multiprocessing.Pool(self.args.workers, analysis.init_worker, (self._analyzer_keys, options)) as pool:
+            for batch in pool.imap(_analyze_batch, docs):
+                yield from batch
+
+    def _docs(self):
+        customer_webpages = cached_corpus.wrap(
+            es_customer_webpages.CustomerWebpages(self.args.customer_id),
+            'webpages-{}'.format(self.args.customer_id),
+            self.args.cache_dir, self.args.cache_ttl_hours, self.args.cache_max_mb)
+
+        fields = ['title', 'content']
+        for doc in customer_webpages.corpus():
+            yield doc['_id'], {field: doc['_source'].get(field) for field in fields}
+
+    def _parse_args(self):
+        parser = argparse.ArgumentParser("writes the analyzed tokens of a customer's webpages for later stages")
+        parser.add_argument('--customer_id', required=True)
+        parser.add_argument('--stem_cache', help='json file used to preload and persist the stemming cache, needs --workers 1')
+        parser.add_argument('--workers', type=int, default=1, help='number of analyzer processes')
+        parser.add_argument('--batch_size', type=int, default=100, help='docs handed to a worker at a time')
+        parser.add_argument('--cache_dir', help='local document cache, fetched docs are replayed from it')
+        parser.add_argument('--cache_ttl_hours', type=float, default=168)
+        parser.add_argument('--cache_max_mb', type=int)
+        self.args = parser.parse_args()
+        # pool workers each fill their own copy of the cache, which is never written back
+        if self.args.stem_cache is not None and 1 < self.args.workers:
+            parser.error('--stem_cache is only saved with --workers 1')
+
+
+def _analyze_batch(batch):
+    analyzer = analysis.get_analyzer()
+    return [(doc_id, {field: analyzer.analyze(word_tokenize(value))
+                      for field, value in fields.items() if value is not None})
+            for doc_id, fields in batch]
+
+if __name__ == '__main__':
+    program = Program()
+    program.main()
@@ -5,77 +5,93 @@ import codecs
 import csv
 import datetime
 import dateutil.parser
-import elasticsearch
+import hashlib
 import json
-import numpy
+import math
 import operator
 import os
 import sys
 
-from gensim import corpora, similarities
+from gensim import corpora
 from nltk.tokenize import word_tokenize
-from scipy.sparse import coo_matrix
 
 from analyzers import factory
+from caching.lru import LruCache
+from corpus import es_client
+from matching.esa_signature import EsaSignature
+from matching.inverted_index import InvertedIndex
+from matching.lsh_index import LshIndex
+from matching.sharded_index import ShardedIndex
+from parallel import ordered
 
 
 class Program:
     def __init__(self):
         self._max_trend_pages_count = 20
-        self._es = elasticsearch.Elasticsearch('signals-es-access-2.test.inspcloud.com')
+        self._es = es_client.get_client()
         analyzer_keys = ['alpha_numeric', 'lowercase', 'remove_stopwords', 'porterstem', 'tokenize_numbers']
-        self._analyzers = [factory.get_analyzer(key) for key in analyzer_keys]
+        self._analyzer = factory.get_pipeline(analyzer_keys)
         self._filter_bow_ids = set()
+        self._dictionary_fingerprints = {}
 
     def main(self):
         self._parse_args()
+        self._load_trend_bow_cache()
         self._load_indexed_trend_ids()
         self._load_gensim_dicts()
         self._load_gensim_index()
-        self._filter_dictionary()
+        try:
+            self._filter_dictionary()
+            self._write_matched_trends()
+        finally:
+            self._close_gensim_index()
+        self._save_trend_bow_cache()
+
+    def _write_matched_trends(self):
         filename = os.path.join('data', 'HSW Facebook Posts With Post Filtered Dates.csv')
         with codecs.open(filename, encoding='utf-8', errors='ignore') as csv_file:
             reader = csv.DictReader(csv_file)
-            loop_counter = 0
-            matched_trends = []
-            for record in reader:
-                loop_counter += 1
-                print('PROCESSING', loop_counter, record, file=sys.stderr)
-
-                doc = self._get_es_webpage(record)
-                if doc is None:
-                    continue
-
-                # trend_id = self._get_best_trend_id(doc, record)
-                try:
-                    trend = self._get_best_trend_id_via_gensim_index(doc)
-                except:
-                    continue
-
-                if trend is None:
-                    continue
-
-                try:
-                    trend_pages = self._get_es_trend_pages_by_trend_id(trend['id'])
-                except:
-                    continue
-
-                match = {
-                    'webpage': doc['_id'],
-                    'trend_id': trend['id'],
-                    'trend_score': trend['score'],
-                    'trend_urls': [hit['_id'] for hit in trend_pages['hits']['hits']]
-                }
-                matched_trends.append(match)
-                continue
-
-            matched_trends.sort(key=lambda x: x['trend_score'], reverse=True)
+            # rows are matched concurrently but results come back in csv order, and the
+            # reader is only advanced as results are taken so at most --concurrency rows are in flight
+            matches = ordered.bounded_map(self._match_record, enumerate(reader, 1), self.args.concurrency)
+            matched_trends = (match for match in matches if match is not None)
+            if self.args.order == 'score':
+                matched_trends = sorted(matched_trends, key=lambda x: x['trend_score'], reverse=True)
 
             with open(os.path.join('out', 'tmp.csv'), 'w') as f:
                 for match in matched_trends:
                     f.write('{},{},{},{}\n'.format(
                         match['webpage'], match['trend_id'], match['trend_score'], ','.join(match['trend_urls'])))
 
+    def _match_record(self, numbered_record):
+        loop_counter, record = numbered_record
+        print('PROCESSING', loop_counter, record, file=sys.stderr)
+
+        doc = self._get_es_webpage(record)
+        if doc is None:
+            return None
+
+        # trend_id = self._get_best_trend_id(doc, record)
+        try:
+            trend = self._get_best_trend_id_via_gensim_index(doc)
+        except:
+            return None
+
+        if trend is None:
+            return None
+
+        try:
+            trend_pages = self._get_es_trend_pages_by_trend_id(trend['id'])
+        except:
+            return None
+
+        return {
+            'webpage': doc['_id'],
+            'trend_id': trend['id'],
+            'trend_score': trend['score'],
+            'trend_urls': [hit['_id'] for hit in trend_pages['hits']['hits']]
+        }
+
     def _get_best_trend_id_via_gensim_index(self, doc):
         title = doc['_source']['title']
         content = doc['_source']['content']
@@ -92,15 +108,20 @@ class Program:
         doc_bow = self._title_content_dict.doc2bow(txt_tokens)
         doc_bow = self._filter_bow(doc_bow)
         sims = self._gensim_index[doc_bow]
-        best_trend = {
-            'id': self._trend_ids[sims[0][0]],
-            'score': sims[0][1]
-        }
-        return best_trend
+        # removed trends are still in the index, take the best one that is not
+        for trend_number, score in sims:
+            trend_id = self._trend_ids[trend_number]
+            if trend_id in self._tombstoned_trend_ids:
+                continue
+            return {
+                'id': trend_id,
+                'score': score
+            }
+        return None
 
     def _get_best_trend_id_via_esa_search(self, doc, csv_record):
         esa_sig = doc['_source']['esaSignature']
-        sig_vector = _parse_esa_signature(esa_sig)
+        sig_vector = EsaSignature.parse(esa_sig)
         esa_matched_trend_pages = self._get_es_trend_pages_by_signature(esa_sig)
         if esa_matched_trend_pages['hits']['total'] == 0:
             return None
@@ -154,32 +175,8 @@ class Program:
 
         trend_scores = {}
         for (k, v) in trend_ids_dict.items():
-            scoring_trend_pages = self._get_es_trend_pages_by_trend_id(k)
-            trend_bow = {}
-            for hit in scoring_trend_pages['hits']['hits']:
-                title = hit['_source']['title']
-                content = hit['_source']['content']
-                txt = ''
-                if title is not None:
-                    txt += title
-                if content is not None:
-                    txt += ' ' + content
-                txt_tokens = self._get_analyzed_tokens(txt)
-                if len(txt_tokens) == 0:
-                    continue
-                tmp_bow = self._title_content_dict.doc2bow(txt_tokens)
-                if len(tmp_bow) == 0:
-                    continue
-                for t in tmp_bow:
-                    if t[0] in trend_bow:
-                        trend_bow[t[0]] += t[1]
-                    else:
-                        trend_bow[t[0]] = t[1]
-
-            trend_bow = [(k, v) for k, v in trend_bow.items()]
-            v1 = _get_dictionary_feature_vector(txt_bow, self._title_content_dict)
-            v2 = _get_dictionary_feature_vector(trend_bow, self._title_content_dict)
-            trend_scores[k] = _get_cosine_similarity(v1, v2)
+            trend_bow, trend_norm = self._get_trend_bow(k, self._title_content_dict, ['title', 'content'])
+            trend_scores[k] = _get_bow_cosine_similarity(txt_bow, trend_bow, trend_norm)
         return trend_scores
 
     def _score_trends_on_title_bow_similarity(self, webpage, trend_ids_dict):
@@ -195,30 +192,45 @@ class Program:
 
         trend_scores = {}
         for (k, v) in trend_ids_dict.items():
-            scoring_trend_pages = self._get_es_trend_pages_by_trend_id(k)
-            trend_bow = {}
-            for hit in scoring_trend_pages['hits']['hits']:
-                title = hit['_source'].get('title')
-                if title is None:
-                    continue
-                title_tokens = self._get_analyzed_tokens(title)
-                if len(title_tokens) == 0:
-                    continue
-                tmp_bow = self._title_dict.doc2bow(title_tokens)
-                if len(tmp_bow) == 0:
-                    continue
-                for t in tmp_bow:
-                    if t[0] in trend_bow:
-                        trend_bow[t[0]] += t[1]
-                    else:
-                        trend_bow[t[0]] = t[1]
-
-            trend_bow = [(v, k) for k, v in trend_bow.items()]
-            v1 = _get_dictionary_feature_vector(title_bow, self._title_dict)
-            v2 = _get_dictionary_feature_vector(trend_bow, self._title_dict)
-            trend_scores[k] = _get_cosine_similarity(v1, v2)
+            trend_bow, trend_norm = self._get_trend_bow(k, self._title_dict, ['title'])
+            trend_scores[k] = _get_bow_cosine_similarity(title_bow, trend_bow, trend_norm)
         return trend_scores
 
+    # the same popular trends come up for many posts, so the summed bow of a
+    # trend's pages and its norm are memoized per dictionary fields. token ids
+    # change when the dictionary is rebuilt, so the key carries its fingerprint
+    def _get_trend_bow(self, trend_id, dictionary, fields):
+        key = '{}/{}/{}'.format(self._get_dictionary_fingerprint(dictionary), '-'.join(fields), trend_id)
+        cached = self._trend_bow_cache.get(key)
+        if cached is not None:
+            return cached
+
+        scoring_trend_pages = self._get_es_trend_pages_by_trend_id(trend_id)
+        trend_bow = {}
+        for hit in scoring_trend_pages['hits']['hits']:
+            txt = ' '.join(value for value in (hit['_source'].get(field) for field in fields) if value is not None)
+            txt_tokens = self._get_analyzed_tokens(txt)
+            if len(txt_tokens) == 0:
+                continue
+            for t in dictionary.doc2bow(txt_tokens):
+                if t[0] in trend_bow:
+                    trend_bow[t[0]] += t[1]
+                else:
+                    trend_bow[t[0]] = t[1]
+
+        trend_bow = [(k, v) for k, v in trend_bow.items()]
+        cached = (trend_bow, _get_bow_norm(trend_bow))
+        self._trend_bow_cache.put(key, cached)
+        return cached
+
+    def _get_dictionary_fingerprint(self, dictionary):
+        fingerprint = self._dictionary_fingerprints.get(id(dictionary))
+        if fingerprint is None:
+            token_ids = json.dumps(sorted(dictionary.token2id.items()))
+            fingerprint = '{}-{}'.format(len(dictionary), hashlib.sha1(token_ids.encode('utf-8')).hexdigest()[:12])
+            self._dictionary_fingerprints[id(dictionary)] = fingerprint
+        return fingerprint
+
     def _score_trends_on_esa_similarity_to_trends_vector_sum(self, webpage_esa_vector, trend_ids_dict):
         trend_scores = {}
         for (k, v) in trend_ids_dict.items():
@@ -226,10 +238,9 @@ class Program:
             if scoring_trend_pages is None:
                 trend_scores[k] = 0
                 continue
-            trend_vector = _parse_esa_signature(scoring_trend_pages['hits']['hits'][0]['_source']['esaSignature'])
-            for hit in scoring_trend_pages['hits']['hits'][1:]:
-                trend_vector += _parse_esa_signature(hit['_source']['esaSignature'])
-            trend_scores[k] = _get_cosine_similarity(webpage_esa_vector, trend_vector)
+            trend_vector = EsaSignature.sum([EsaSignature.parse(hit['_source']['esaSignature'])
+                                             for hit in scoring_trend_pages['hits']['hits']])
+            trend_scores[k] = webpage_esa_vector.cosine(trend_vector)
         return trend_scores
 
     def _score_trends_on_number_of_esa_matches(self, trend_ids_dict):
@@ -327,12 +338,7 @@ class Program:
             return None
 
     def _get_analyzed_tokens(self, string):
-        tokens = word_tokenize(string)
-
-        for analyzer in self._analyzers:
-            tokens = analyzer.analyze(tokens)
-
-        return tokens
+        return self._analyzer.analyze(word_tokenize(string))
 
     def _filter_bow(self, bow):
         return [x for x in bow if x[0] not in self._filter_bow_ids]
@@ -341,6 +347,17 @@ class Program:
         with open(os.path.join('out', 'gensim-similarity-20160608-ordinal.js')) as f:
             trends = json.load(f)
         self._trend_ids = trends['ids']
+        self._tombstoned_trend_ids = set(trends.get('tombstones', []))
+
+    def _load_trend_bow_cache(self):
+        self._trend_bow_cache = LruCache(self.args.trend_bow_cache_size)
+        if self.args.trend_bow_cache is not None and os.path.exists(self.args.trend_bow_cache):
+            self._trend_bow_cache.load(self.args.trend_bow_cache)
+
+    def _save_trend_bow_cache(self):
+        print('trend bow cache', self._trend_bow_cache.info(), file=sys.stderr)
+        if self.args.trend_bow_cache is not None:
+            self._trend_bow_cache.save(self.args.trend_bow_cache)
 
     def _load_gensim_dicts(self):
         # self._title_dict = corpora.Dictionary.load(os.path.join('out', 'title-dict-unabridged.mm'))
@@ -356,39 +373,46 @@ class Program:
         self._filter_bow_ids.add(self._title_content_dict.token2id['{__NUMBER__}'])
 
     def _load_gensim_index(self):
-        self._gensim_index = similarities.Similarity.load(fname=os.path.join('out', 'gensim-similarity-20160608-index'))
+        if self.args.backend == 'lsh':
+            self._gensim_index = LshIndex.load(os.path.join('out', 'lsh-20160608-index'), mmap='r')
+            self._gensim_index.probe_radius = self.args.lsh_probe_radius
+            return
+        if self.args.backend == 'inverted':
+            self._gensim_index = InvertedIndex.load(os.path.join('out', 'inverted-20160608-index'))
+            return
+
+        self._gensim_index = ShardedIndex.load(
+            os.path.join('out', 'gensim-similarity-20160608-index'), self.args.shard_workers)
+
+    # stops the shard query processes
+    def _close_gensim_index(self):
+        if isinstance(self._gensim_index, ShardedIndex):
+            self._gensim_index.close()
 
     def _parse_args(self):
         parser = argparse.ArgumentParser('generate training data file for linear modeling of facebook ctr')
         # parser.add_argument('--foo', required=False, help='placeholder')
+        parser.add_argument('--trend_bow_cache', help='json file used to preload and persist the trend bow cache')
+        parser.add_argument('--trend_bow_cache_size', type=int, default=10000)
+        parser.add_argument('--concurrency', type=int, default=1, help='csv rows matched at the same time')
+        parser.add_argument('--shard_workers', type=int, default=1,
+                            help='processes querying the index shards in parallel, needs as many cores')
+        parser.add_argument('--backend', choices=['exact', 'lsh', 'inverted'], default='exact', help='trend index to match with')
+        parser.add_argument('--lsh_probe_radius', type=int, default=1, help='bits flipped when probing lsh buckets')
+        parser.add_argument('--order', choices=['score', 'input'], default='score', help='order of the output rows')
         self.args = parser.parse_args()
 
 
-def _get_cosine_similarity(vector_one, vector_two):
-    inner = vector_two.transpose().dot(vector_one)
-    if inner.nnz == 0:
+def _get_bow_norm(bow):
+    return math.sqrt(sum(v * v for k, v in bow))
+
+
+def _get_bow_cosine_similarity(bow, trend_bow, trend_norm):
+    weights = dict(bow)
+    inner = sum(weights.get(k, 0) * v for k, v in trend_bow)
+    if inner == 0:
         return float(0)
-    magnitude_one = numpy.sqrt(vector_one.transpose().dot(vector_one))
-    magnitude_two = numpy.sqrt(vector_two.transpose().dot(vector_two))
-    similarity = inner / (magnitude_one * magnitude_two)
-    return similarity[0, 0]
-
-
-def _parse_esa_signature(sig):
-    sig = sig.strip()
-    sig = sig.split('\t')
-    row = sig[::2]
-    row = [int(x) for x in row]
-    col = numpy.zeros(len(row), dtype=numpy.int32)
-    data = sig[1::2]
-    data = [float(x) for x in data]
-    return coo_matrix((data, (row, col)), shape=(100000000, 1))
-
-
-def _get_dictionary_feature_vector(feature_tuples, dictionary):
-    [row, data] = zip(*feature_tuples)
-    col = numpy.zeros(len(row), dtype=numpy.int32)
-    return coo_matrix((data, (row, col)), shape=(len(dictionary.keys()), 1))
+    return inner / (_get_bow_norm(bow) * trend_norm)
 
 if __name__ == '__main__':
     program = Program()
@@ -1,29 +1,31 @@
 #!/usr/bin/env python3
 
 import argparse
-import elasticsearch
 import json
 
-from elasticsearch.helpers import scan
+from corpus import es_client
+from corpus.sliced_scan import sliced_scan
 
 
 class Program:
 
     def main(self):
         self._parse_args()
-        es = elasticsearch.Elasticsearch('signals-es-access-1.test.inspcloud.com')
+        es = es_client.get_client()
         ids = {hit['_source']['trendId'] for hit in
-               scan(es,
-                    query={"query": {"match_all": {}}},
-                    index="google-trends-aggregator-20160207-000007",
-                    doc_type="googleTrendsTimeSeries",
-                    _source=['trendId']
-                    )}
+               sliced_scan(es,
+                           query={"query": {"match_all": {}}},
+                           index="google-trends-aggregator-20160207-000007",
+                           doc_type="googleTrendsTimeSeries",
+                           slices=self.args.slices,
+                           _source=['trendId']
+                           )}
         trends = {'ids': list(ids)}
         print(json.dumps(trends))
 
     def _parse_args(self):
         parser = argparse.ArgumentParser('writes to stdout the trendIds as json')
+        parser.add_argument('--slices', type=int, help='concurrent sliced scrolls, needs elasticsearch 5+')
         self.args = parser.parse_args()
 
 if __name__ == '__main__':
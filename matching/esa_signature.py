@@ -0,0 +1,73 @@
+import numpy
+
+
+class EsaSignature:
+    """ESA signature as feature ids sorted ascending with their weights and a cached norm."""
+
+    def __init__(self, ids, weights):
+        self.ids = ids
+        self.weights = weights
+        squares = numpy.square(weights, dtype=numpy.float64)
+        self.norm = float(numpy.sqrt(squares.sum()))
+
+    @classmethod
+    def parse(cls, sig):
+        """Parse the tab separated 'id weight id weight ...' form stored in esaSignature."""
+        values = numpy.fromstring(sig, dtype=numpy.float64, sep='\t')
+        ids = values[::2].astype(numpy.int32)
+        weights = values[1::2].astype(numpy.float32)
+
+        order = numpy.argsort(ids, kind='mergesort')
+        ids = ids[order]
+        weights = weights[order]
+        if numpy.any(ids[1:] == ids[:-1]):
+            ids, inverse = numpy.unique(ids, return_inverse=True)
+            weights = numpy.bincount(inverse, weights=weights).astype(numpy.float32)
+
+        return cls(ids, weights)
+
+    @classmethod
+    def sum(cls, signatures):
+        """Merge-add signatures, summing the weights of shared feature ids."""
+        if len(signatures) == 0:
+            return cls(numpy.zeros(0, dtype=numpy.int32), numpy.zeros(0, dtype=numpy.float32))
+
+        ids = numpy.concatenate([signature.ids for signature in signatures])
+        weights = numpy.concatenate([signature.weights for signature in signatures])
+        ids, inverse = numpy.unique(ids, return_inverse=True)
+        return cls(ids, numpy.bincount(inverse, weights=weights).astype(numpy.float32))
+
+    def __add__(self, other):
+        return EsaSignature.sum([self, other])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def dot(self, other):
+        _, mine, theirs = numpy.intersect1d(self.ids, other.ids, assume_unique=True, return_indices=True)
+        return float(numpy.dot(self.weights[mine].astype(numpy.float64), other.weights[theirs]))
+
+    def cosine(self, other):
+        if self.norm == 0 or other.norm == 0:
+            return float(0)
+        return self.dot(other) / (self.norm * other.norm)
+
+    def cosine_many(self, others):
+        """Cosine similarity of this signature against each of others, in one vectorized pass."""
+        similarities = numpy.zeros(len(others), dtype=numpy.float64)
+        if len(self.ids) == 0 or len(others) == 0:
+            return similarities
+
+        ids = numpy.concatenate([other.ids for other in others])
+        weights = numpy.concatenate([other.weights for other in others]).astype(numpy.float64)
+        owners = numpy.repeat(numpy.arange(len(others)), [len(other.ids) for other in others])
+
+        positions = numpy.searchsorted(self.ids, ids)
+        positions[positions == len(self.ids)] = 0
+        matched = self.ids[positions] == ids
+        products = weights[matched] * self.weights[positions[matched]]
+        inner = numpy.bincount(owners[matched], weights=products, minlength=len(others))
+
+        denominators = self.norm * numpy.array([other.norm for other in others])
+        numpy.divide(inner, denominators, out=similarities, where=denominators != 0)
+        return similarities
@@ -0,0 +1,197 @@
+import threading
+
+import numpy
+import scipy.sparse
+from gensim import utils
+
+# results of a chunk query are a queries x docs sparse matrix, chunks are split to keep it bounded
+_MAX_RESULT_CELLS = 2 ** 25
+
+
+class InvertedIndex(utils.SaveLoad):
+    """Exact top num_best cosine matching over posting lists.
+
+    The normalized tf-idf (or raw tf) weights are kept token-major in a CSR
+    matrix, so a query only touches the postings of its own tokens, and a chunk
+    of queries is answered with one sparse product. For single queries the
+    weights are also split into blocks of block_size docs with every token's
+    max weight per block; the blocks with the highest upper bound are scored
+    first, until no remaining block can reach the current top num_best. Call
+    it like a gensim Similarity: index[bow] or index[chunk of bows].
+    """
+
+    def __init__(self, num_features, num_best=10, weighting='tfidf', block_size=4096):
+        self.num_features = num_features
+        self.num_best = num_best
+        self.weighting = weighting
+        self.block_size = block_size
+        self._num_docs = 0
+        self._raw = []
+        self._build_lock = threading.Lock()
+        self._weights = None
+
+    def __len__(self):
+        return self._num_docs
+
+    def add_documents(self, corpus):
+        docs, token_ids, tfs = [], [], []
+        for bow in corpus:
+            for token_id, tf in bow:
+                docs.append(self._num_docs)
+                token_ids.append(token_id)
+                tfs.append(tf)
+            self._num_docs += 1
+        self._raw.append((numpy.asarray(docs, dtype=numpy.int64),
+                          numpy.asarray(token_ids, dtype=numpy.int64),
+                          numpy.asarray(tfs, dtype=numpy.float64)))
+
+        # idf and doc norms depend on the whole corpus, so weights are rebuilt on the next query
+        with self._build_lock:
+            self._weights = None
+
+    def save(self, *args, **kwargs):
+        # the weights and block maxima are derived from the raw postings and rebuilt after load
+        kwargs['ignore'] = frozenset(kwargs.get('ignore', ())) | {
+            '_build_lock', '_weights', '_idfs', '_blocks', '_block_max'}
+        super(InvertedIndex, self).save(*args, **kwargs)
+
+    @classmethod
+    def load(cls, *args, **kwargs):
+        index = super(InvertedIndex, cls).load(*args, **kwargs)
+        index._build_lock = threading.Lock()
+        return index
+
+    def __getitem__(self, query):
+        # queries may come from several threads, the first one builds the weights for all
+        with self._build_lock:
+            if self._weights is None:
+                self._build()
+
+        is_corpus, query = utils.is_corpus(query)
+        if is_corpus:
+            return self._top_k_chunk(list(query))
+        return self._top_k(query)
+
+    def _build(self):
+        if 1 < len(self._raw):
+            self._raw = [tuple(numpy.concatenate(arrays) for arrays in zip(*self._raw))]
+        docs, token_ids, tfs = self._raw[0] if self._raw else (numpy.zeros(0, dtype=numpy.int64),) * 3
+        num_features = max(self.num_features, int(token_ids.max()) + 1 if len(token_ids) else 0)
+
+        # tokens the index has never seen still count towards the query norm with raw weights, as in gensim
+        dfs = numpy.bincount(token_ids, minlength=num_features)
+        if self.weighting == 'raw':
+            idfs = numpy.ones(num_features)
+        else:
+            idfs = numpy.zeros(num_features)
+            seen = 0 < dfs
+            idfs[seen] = numpy.log2(self._num_docs / dfs[seen])
+
+        weights = tfs * idfs[token_ids]
+        norms = numpy.sqrt(numpy.bincount(docs, weights=numpy.square(weights), minlength=self._num_docs))
+        norms[norms == 0] = 1
+        weights = weights / norms[docs]
+        kept = 0 < weights
+        matrix = scipy.sparse.csr_matrix(
+            (weights[kept].astype(numpy.float32), (token_ids[kept], docs[kept])),
+            shape=(num_features, self._num_docs))
+
+        # single queries are scored block by block, so the weights are also kept split into
+        # blocks of block_size docs along with every token's max weight in each block
+        blocks = []
+        max_rows, max_columns, max_weights = [], [], []
+        for block_number, first_doc in enumerate(range(0, self._num_docs, self.block_size)):
+            block = matrix[:, first_doc:first_doc + self.block_size].tocsr()
+            rows = numpy.flatnonzero(numpy.diff(block.indptr))
+            if len(rows):
+                max_rows.append(rows)
+                max_columns.append(numpy.full(len(rows), block_number))
+                max_weights.append(numpy.maximum.reduceat(block.data, block.indptr[rows]))
+            blocks.append(block)
+        self._blocks = blocks
+        no_entries = numpy.zeros(0, dtype=numpy.int64)
+        self._block_max = scipy.sparse.csr_matrix(
+            (numpy.concatenate(max_weights + [numpy.zeros(0, dtype=numpy.float32)]),
+             (numpy.concatenate(max_rows + [no_entries]), numpy.concatenate(max_columns + [no_entries]))),
+            shape=(num_features, len(blocks)))
+
+        self._idfs = idfs
+        self._weights = matrix
+
+    # normalized query weights of the tokens that have postings
+    def _query_weights(self, bow):
+        if len(bow) == 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+        token_ids = numpy.fromiter((token_id for token_id, _ in bow), dtype=numpy.int64, count=len(bow))
+        tfs = numpy.fromiter((tf for _, tf in bow), dtype=numpy.float64, count=len(bow))
+
+        known = token_ids < len(self._idfs)
+        unseen_idf = 1.0 if self.weighting == 'raw' else 0.0
+        weights = tfs * numpy.where(known, self._idfs[numpy.where(known, token_ids, 0)], unseen_idf)
+        query_norm = numpy.sqrt(numpy.square(weights).sum())
+        if query_norm == 0:
+            return token_ids[:0], weights[:0]
+
+        kept = known & (0 < weights)
+        return token_ids[kept], weights[kept] / query_norm
+
+    def _query_matrix(self, bows):
+        indptr = [0]
+        indices = [numpy.zeros(0, dtype=numpy.int64)]
+        data = [numpy.zeros(0)]
+        for bow in bows:
+            token_ids, weights = self._query_weights(bow)
+            indices.append(token_ids)
+            data.append(weights)
+            indptr.append(indptr[-1] + len(token_ids))
+        return scipy.sparse.csr_matrix(
+            (numpy.concatenate(data), numpy.concatenate(indices).astype(numpy.int32), indptr),
+            shape=(len(bows), self._weights.shape[0]))
+
+    def _top_k(self, bow):
+        query = self._query_matrix([bow])
+        if query.nnz == 0:
+            return []
+
+        # blocks with the best upper bound first, until none can beat the num_best found so far
+        bounds = (query * self._block_max).toarray().ravel()
+        order = numpy.argsort(-bounds, kind='mergesort')
+
+        top_docs = numpy.zeros(0, dtype=numpy.int64)
+        top_sims = numpy.zeros(0)
+        threshold = 0.0
+        for block_number in order:
+            if bounds[block_number] <= threshold:
+                break
+
+            sims = query * self._blocks[block_number]
+            hits = 1e-9 < sims.data
+            top_docs = numpy.r_[top_docs, sims.indices[hits] + block_number * self.block_size]
+            top_sims = numpy.r_[top_sims, sims.data[hits]]
+            if self.num_best is not None and self.num_best <= len(top_docs):
+                best = numpy.argpartition(-top_sims, self.num_best - 1)[:self.num_best]
+                top_docs, top_sims = top_docs[best], top_sims[best]
+                threshold = top_sims.min()
+
+        return _sorted_results(top_docs, top_sims, self.num_best)
+
+    def _top_k_chunk(self, bows):
+        results = []
+        chunk_size = max(1, _MAX_RESULT_CELLS // max(self._num_docs, 1))
+        for first in range(0, len(bows), chunk_size):
+            sims = (self._query_matrix(bows[first:first + chunk_size]) * self._weights).tocsr()
+            for row in range(sims.shape[0]):
+                row_sims = sims.data[sims.indptr[row]:sims.indptr[row + 1]]
+                row_docs = sims.indices[sims.indptr[row]:sims.indptr[row + 1]]
+                hits = 1e-9 < row_sims
+                results.append(_sorted_results(row_docs[hits], row_sims[hits], self.num_best))
+
+        return results
+
+
+def _sorted_results(docs, sims, num_best):
+    if num_best is not None and num_best < len(docs):
+        best = numpy.argpartition(-sims, num_best - 1)[:num_best]
+        docs, sims = docs[best], sims[best]
+    order = numpy.lexsort((docs, -sims))
+    return [(int(docs[i]), float(sims[i])) for i in order]
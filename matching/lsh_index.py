@@ -0,0 +1,83 @@
+import itertools
+
+import numpy
+import scipy.sparse
+from gensim import matutils, utils
+
+
+class LshIndex(utils.SaveLoad):
+    """Approximate cosine similarity index using random hyperplane LSH.
+
+    Each of num_tables tables hashes a unit-normalized BOW to num_bits sign bits
+    of random projections. A query collects the docs in its bucket, and in the
+    buckets within probe_radius flipped bits, of every table, and ranks only
+    those candidates by exact cosine. More tables or a larger probe radius raise
+    recall; more bits make buckets smaller and queries faster.
+    """
+
+    def __init__(self, num_features, num_best=10, num_tables=8, num_bits=12, probe_radius=1, seed=0):
+        self.num_features = num_features
+        self.num_best = num_best
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.probe_radius = probe_radius
+
+        random = numpy.random.RandomState(seed)
+        self._planes = random.standard_normal((num_features, num_tables * num_bits)).astype(numpy.float32)
+        self._bit_values = (1 << numpy.arange(num_bits)).astype(numpy.int64)
+        self._tables = [{} for _ in range(num_tables)]
+        self._vectors = scipy.sparse.csr_matrix((0, num_features), dtype=numpy.float32)
+
+    def __len__(self):
+        return self._vectors.shape[0]
+
+    def add_documents(self, corpus):
+        vectors = self._to_matrix(list(corpus))
+        first_id = len(self)
+        for doc_number, codes in enumerate(self._hash(vectors)):
+            for table, code in zip(self._tables, codes):
+                table.setdefault(int(code), []).append(first_id + doc_number)
+
+        self._vectors = scipy.sparse.vstack([self._vectors, vectors], format='csr')
+
+    def __getitem__(self, query):
+        is_corpus, query = utils.is_corpus(query)
+        queries = list(query) if is_corpus else [query]
+
+        vectors = self._to_matrix(queries)
+        results = [self._query(vectors[i], codes) for i, codes in enumerate(self._hash(vectors))]
+        return results if is_corpus else results[0]
+
+    def _query(self, vector, codes):
+        candidates = set()
+        for table, code in zip(self._tables, codes):
+            for probe in self._probes(int(code)):
+                candidates.update(table.get(probe, ()))
+        if len(candidates) == 0:
+            return []
+
+        candidates = numpy.fromiter(candidates, dtype=numpy.int64, count=len(candidates))
+        sims = numpy.asarray(self._vectors[candidates].dot(vector.T).todense()).ravel()
+        order = numpy.argsort(-sims, kind='mergesort')[:self.num_best]
+        return [(int(candidates[j]), float(sims[j])) for j in order if 1e-9 < abs(sims[j])]
+
+    def _probes(self, code):
+        yield code
+        for radius in range(1, self.probe_radius + 1):
+            for bits in itertools.combinations(range(self.num_bits), radius):
+                probe = code
+                for bit in bits:
+                    probe ^= 1 << bit
+                yield probe
+
+    def _hash(self, vectors):
+        projections = vectors.dot(self._planes)
+        bits = (0 < projections).reshape(vectors.shape[0], self.num_tables, self.num_bits)
+        return bits.dot(self._bit_values)
+
+    def _to_matrix(self, bows):
+        vectors = matutils.corpus2csc(bows, num_terms=self.num_features, num_docs=len(bows), dtype=numpy.float32)
+        vectors = vectors.T.tocsr()
+        norms = numpy.sqrt(numpy.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return scipy.sparse.csr_matrix(scipy.sparse.diags(1 / norms).dot(vectors), dtype=numpy.float32)
@@ -0,0 +1,139 @@
+import multiprocessing
+import os
+
+import numpy
+from gensim import similarities, utils
+
+
+def separate_shard_arrays(index, first_shard=0):
+    """Re-save the shards of a Similarity index with their arrays in separate .npy files.
+
+    gensim pickles arrays under 10MB inside the shard file, and those are read
+    into memory on load. Stored separately they are memory-mapped, so several
+    processes querying the same index share one page cache copy. Shards before
+    first_shard are left alone, e.g. the ones an appended index was loaded with.
+    """
+    for shard in index.shards[first_shard:]:
+        # the shard may be mapped from the very files being written, so they are written under a
+        # temporary name and moved over the old ones, which stay mapped until the shard is reopened
+        fname = shard.fullname()
+        tmp_fname = '{}.tmp'.format(fname)
+        shard.get_index().save(tmp_fname, sep_limit=0)
+        tmp_dir, tmp_name = os.path.split(tmp_fname)
+        for name in os.listdir(tmp_dir or '.'):
+            if name == tmp_name or name.startswith(tmp_name + '.'):
+                os.replace(os.path.join(tmp_dir, name), fname + name[len(tmp_name):])
+        del shard.index
+
+
+def load_appendable(fname):
+    """Load a saved Similarity index so more documents can be added to it.
+
+    gensim reopens an incomplete last shard from its memory-mapped arrays and
+    later overwrites the same file, so that shard is read into memory instead.
+    """
+    index = similarities.Similarity.load(fname)
+    if index.shards and len(index.shards[-1]) < index.shardsize:
+        last_shard = index.shards[-1]
+        last_shard.index = last_shard.cls.load(last_shard.fullname())
+    return index
+
+
+class ShardedIndex:
+    """Query engine over the shards of a saved gensim Similarity index.
+
+    Shards are memory-mapped and, with workers > 1, queried in a pool of
+    processes that each map the same shard files, so they share one page
+    cache copy. The per-shard results are merged into the num_best overall.
+    Supports the same index[bow] and index[chunk of bows] calls as Similarity.
+    """
+
+    def __init__(self, index, workers=1, fname=None):
+        self._index = index
+        self._pool = None
+        if 1 < workers:
+            if fname is None:
+                raise ValueError('workers > 1 needs the fname the index was saved under')
+            # the query work holds the gil, so shards are queried in processes rather than threads
+            self._pool = multiprocessing.Pool(workers, _init_worker, (fname, index.output_prefix))
+        self.num_best = index.num_best
+        self._offsets = numpy.cumsum([0] + [len(shard) for shard in index.shards])
+        for shard in index.shards:
+            shard.get_index()
+
+    @classmethod
+    def load(cls, fname, workers=1, output_prefix=None):
+        index = _load_index(fname, output_prefix)
+        return cls(index, workers, fname)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, query):
+        is_corpus, query = utils.is_corpus(query)
+        queries = list(query) if is_corpus else [query]
+
+        shard_numbers = range(len(self._index.shards))
+        if self._pool is None:
+            shard_results = [_query_shard(self._index, self._offsets, n, queries) for n in shard_numbers]
+        else:
+            shard_results = self._pool.map(_query_worker_shard, [(n, queries) for n in shard_numbers])
+
+        results = []
+        for i in range(len(queries)):
+            ids = numpy.concatenate([ids[i] for ids, sims in shard_results])
+            sims = numpy.concatenate([sims[i] for ids, sims in shard_results])
+            order = numpy.argsort(-sims, kind='mergesort')[:self.num_best]
+            results.append([(int(ids[j]), float(sims[j])) for j in order])
+
+        return results if is_corpus else results[0]
+
+
+def _load_index(fname, output_prefix=None):
+    index = similarities.Similarity.load(fname, mmap='r')
+    if output_prefix is not None:
+        index.output_prefix = output_prefix
+        index.check_moved()
+    return index
+
+
+# set in every pool worker by _init_worker
+_worker_index = None
+_worker_offsets = None
+
+
+def _init_worker(fname, output_prefix):
+    global _worker_index, _worker_offsets
+    _worker_index = _load_index(fname, output_prefix)
+    _worker_offsets = numpy.cumsum([0] + [len(shard) for shard in _worker_index.shards])
+
+
+def _query_worker_shard(shard_query):
+    shard_number, queries = shard_query
+    return _query_shard(_worker_index, _worker_offsets, shard_number, queries)
+
+
+# returns, per query, the global ids and similarities of the shard's
+# num_best most similar docs (or of all its docs when num_best is None)
+def _query_shard(index, offsets, shard_number, queries):
+    shard_index = index.shards[shard_number].get_index()
+    shard_index.num_best = None
+    shard_index.normalize = index.norm
+    sims = numpy.atleast_2d(numpy.asarray(shard_index[queries]))
+
+    top_ids = []
+    top_sims = []
+    for row in sims:
+        ids = numpy.flatnonzero(numpy.abs(row) > 1e-9)
+        if index.num_best is not None and index.num_best < len(ids):
+            ids = ids[numpy.argpartition(-row[ids], index.num_best - 1)[:index.num_best]]
+        top_ids.append(ids + offsets[shard_number])
+        top_sims.append(row[ids])
+
+    return top_ids, top_sims
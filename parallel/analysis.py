@@ -0,0 +1,13 @@
+from analyzers import factory
+
+# set in every pool worker by init_worker so the pipeline is built once per process
+_analyzer = None
+
+
+def init_worker(analyzer_keys, options=None):
+    global _analyzer
+    _analyzer = factory.get_pipeline(analyzer_keys, options)
+
+
+def get_analyzer():
+    return _analyzer
@@ -0,0 +1,10 @@
+import itertools
+
+
+def batches(iterable, size):
+    """Yield successive lists of at most size items from any iterable."""
+    iterator = iter(iterable)
+    batch = list(itertools.islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(itertools.islice(iterator, size))
@@ -0,0 +1,23 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def bounded_map(fn, iterable, max_in_flight):
+    """Like map(), but runs up to max_in_flight calls concurrently in threads.
+
+    Results are yielded in input order, and the input is consumed only as
+    fast as results are taken, so a slow consumer applies backpressure.
+    """
+    if max_in_flight <= 1:
+        yield from map(fn, iterable)
+        return
+
+    with ThreadPoolExecutor(max_in_flight) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(fn, item))
+            if max_in_flight <= len(pending):
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
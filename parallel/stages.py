@@ -0,0 +1,145 @@
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.waiting = 0.0
+
+    def format(self, elapsed, waiting_on):
+        return '{} {} items {:.1f}/s waiting on {} {:.0%}'.format(
+            self.name, self.items, self.items / elapsed, waiting_on, min(self.waiting / elapsed, 1.0))
+
+
+class Stages:
+    """Connects a source, a pool of analyzer processes and the consumer through bounded queues.
+
+    The source is iterated in its own thread into a queue of at most queue_size
+    items, so scroll requests keep going while items are analyzed. fn runs on
+    every item in workers processes set up by initializer (or in the calling
+    thread when workers <= 1), at most 2 * workers at a time. Iterating the
+    Stages yields the results in source order, which makes the caller the sink.
+    Per-stage throughput, time spent waiting on the neighbouring stage and the
+    queue depth are printed to stderr every report_seconds and at the end.
+    """
+
+    def __init__(self, source, fn, workers=1, initializer=None, initargs=(), queue_size=16,
+                 report_seconds=60, name='stages'):
+        self._source = source
+        self._fn = fn
+        self._workers = workers
+        self._initializer = initializer
+        self._initargs = initargs
+        self._queue = queue.Queue(queue_size)
+        self._report_seconds = report_seconds
+        self._name = name
+
+        self._stopped = threading.Event()
+        self._source_stats = StageStats('source')
+        self._analyze_stats = StageStats('analyze')
+        self._sink_stats = StageStats('sink')
+        self._depth_total = 0
+        self._depth_max = 0
+
+    def __iter__(self):
+        self._started = time.time()
+        self._reported = self._started
+        source_thread = threading.Thread(target=self._run_source, daemon=True)
+        source_thread.start()
+        try:
+            if self._workers <= 1:
+                if self._initializer is not None:
+                    self._initializer(*self._initargs)
+                yield from self._sink(map(self._fn, self._queued()))
+            else:
+                with multiprocessing.Pool(self._workers, self._initializer, self._initargs) as pool:
+                    yield from self._sink(self._pool_results(pool))
+            self._report()
+        finally:
+            # a source blocked on a full queue notices this within a second and exits
+            self._stopped.set()
+
+    def _run_source(self):
+        try:
+            for item in self._source:
+                if not self._put(item):
+                    return
+                self._source_stats.items += 1
+            self._put(_DONE)
+        except BaseException as e:
+            self._put(e)
+
+    # blocks while the queue is full, giving up once the consumer has stopped
+    def _put(self, item):
+        started = time.time()
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                self._source_stats.waiting += time.time() - started
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _queued(self):
+        while True:
+            depth = self._queue.qsize()
+            self._depth_total += depth
+            self._depth_max = max(self._depth_max, depth)
+
+            started = time.time()
+            item = self._queue.get()
+            self._analyze_stats.waiting += time.time() - started
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    # pool.imap() would drain the queue as fast as the source fills it, so
+    # tasks are submitted only as results are taken
+    def _pool_results(self, pool):
+        pending = deque()
+        for item in self._queued():
+            pending.append(pool.apply_async(self._fn, (item,)))
+            if 2 * self._workers <= len(pending):
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+    def _sink(self, results):
+        results = iter(results)
+        while True:
+            started = time.time()
+            try:
+                result = next(results)
+            except StopIteration:
+                return
+            self._sink_stats.waiting += time.time() - started
+            self._analyze_stats.items += 1
+
+            yield result
+            self._sink_stats.items += 1
+
+            if self._report_seconds is not None and self._report_seconds <= time.time() - self._reported:
+                self._report()
+
+    def _report(self):
+        self._reported = time.time()
+        elapsed = max(self._reported - self._started, 1e-9)
+        depth_mean = self._depth_total / max(self._analyze_stats.items, 1)
+        print('{} {:.0f}s: {}, {}, {}, queue depth mean {:.1f} max {}'.format(
+            self._name, elapsed,
+            self._source_stats.format(elapsed, 'analyze'),
+            self._analyze_stats.format(elapsed, 'source'),
+            self._sink_stats.format(elapsed, 'analyze'),
+            depth_mean, self._depth_max), file=sys.stderr)
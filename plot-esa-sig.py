@@ -3,12 +3,12 @@
 import argparse
 import matplotlib.pyplot as plt
 
-from elasticsearch import Elasticsearch
+from corpus import es_client
 
 
 class Program:
     def __init__(self):
-        self._es = Elasticsearch('http://signals-es-access-1.test.inspcloud.com/')
+        self._es = es_client.get_client()
 
     def main(self):
         self._parse_args()
@@ -3,8 +3,16 @@
 import argparse
 import json
 import fileinput
+import sys
+import time
 
-from boto3 import resource as aws
+import boto3
+
+from parallel import ordered
+
+# sqs limits a message, and a whole send_message_batch call, to 256KB and a batch to 10 messages
+MAX_BYTES = 256 * 1024
+MAX_BATCH_MESSAGES = 10
 
 
 class Program:
@@ -12,33 +20,92 @@ class Program:
     def main(self):
         self._parse_args()
 
-        urls = []
+        self._client = boto3.client('sqs', endpoint_url=self.args.endpoint_url)
+        self._queue_url = self._client.get_queue_url(QueueName=self.args.queue)['QueueUrl']
+
+        # stdin is read only as fast as batches are sent
+        batches = self._batches(self._messages(self._urls()))
+        sent = 0
+        failed = 0
+        for batch_sent, batch_failed in ordered.bounded_map(self._send_batch, batches, self.args.concurrency):
+            sent += batch_sent
+            failed += batch_failed
+        print('sent {} messages, {} failed'.format(sent, failed), file=sys.stderr)
+
+    def _urls(self):
         for line in fileinput.input(files=('-')):
             url = line.strip()
-            if url is not None:
-                urls.append(url)
+            if url:
+                yield url
+
+    # up to --urls_per_message urls per message, fewer when the body would pass the size limit
+    def _messages(self, urls):
+        chunk = []
+        for url in urls:
+            if chunk and (len(chunk) == self.args.urls_per_message or MAX_BYTES < _body_size(chunk + [url])):
+                yield json.dumps({'urls': chunk})
+                chunk = []
+
+            if MAX_BYTES < _body_size([url]):
+                print('skipping url longer than the message size limit: {}...'.format(url[:100]), file=sys.stderr)
+                continue
+            chunk.append(url)
+
+        if chunk:
+            yield json.dumps({'urls': chunk})
+
+    def _batches(self, messages):
+        batch = []
+        batch_bytes = 0
+        for message in messages:
+            message_bytes = len(message.encode('utf-8'))
+            if batch and (len(batch) == MAX_BATCH_MESSAGES or MAX_BYTES < batch_bytes + message_bytes):
+                yield batch
+                batch = []
+                batch_bytes = 0
+
+            batch.append(message)
+            batch_bytes += message_bytes
+
+        if batch:
+            yield batch
+
+    # only the entries sqs reports as failed are resent, unless the failure is the sender's fault
+    def _send_batch(self, messages):
+        entries = [{'Id': str(i), 'MessageBody': message} for i, message in enumerate(messages)]
+        failed = 0
+        for attempt in range(self.args.max_retries + 1):
+            if attempt:
+                time.sleep(min(30, 2 ** attempt))
+
+            response = self._client.send_message_batch(QueueUrl=self._queue_url, Entries=entries)
+            failures = response.get('Failed', [])
+            for failure in failures:
+                if failure.get('SenderFault'):
+                    print('message rejected: {}'.format(failure.get('Message')), file=sys.stderr)
+                    failed += 1
 
-        client = aws('sqs')
-        queue = client.get_queue_by_name(QueueName=self.args.queue)
-        for chunk in chunks(urls, 20):
-            msg = {
-                'urls': chunk
-            }
+            retry_ids = {failure['Id'] for failure in failures if not failure.get('SenderFault')}
+            entries = [entry for entry in entries if entry['Id'] in retry_ids]
+            if not entries:
+                break
 
-            msg_body = json.dumps(msg)
-            queue.send_message(MessageBody=msg_body)
+        failed += len(entries)
+        return len(messages) - failed, failed
 
     def _parse_args(self):
         description = 'reads a list of urls from stdin and sends them in chunks to an sqs queue'
         parser = argparse.ArgumentParser(description)
         parser.add_argument('--queue', required=True, help='e.g. signals-diffgen-test, signals-embedly-urls-test')
+        parser.add_argument('--urls_per_message', type=int, default=20)
+        parser.add_argument('--concurrency', type=int, default=8, help='send_message_batch calls in flight')
+        parser.add_argument('--max_retries', type=int, default=5, help='resends of failed entries')
+        parser.add_argument('--endpoint_url', help='sqs endpoint, e.g. a local stand-in like http://localhost:9324')
         self.args = parser.parse_args()
 
 
-def chunks(l, n):
-    """Yield successive n-sized chunks from l."""
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+def _body_size(urls):
+    return len(json.dumps({'urls': urls}).encode('utf-8'))
 
 if __name__ == '__main__':
     program = Program()